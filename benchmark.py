@@ -0,0 +1,414 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import cv2
+import numpy as np
+import blinkdataset
+from blinkdataset import make_windows
+from blinkdetector import BlinkDetector
+from blinkmodel import BlinkModel
+from framesource import open_source
+from governor import FrameRateGovernor
+from latency import LatencyMonitor
+
+SYNTHETIC_SHAPE = (480, 640, 3)     # Shape of the synthetic frames, matching a VGA webcam
+SYNTHETIC_POOL = 8  # Number of distinct synthetic frames cycled through, generated before timing starts
+
+
+def run_detector(file_path, tracking_mode, roi_mode):
+    """
+    Runs a blink detector over every frame of a video file. Returns an array of per-frame face detection flags, the
+    processing time in seconds and the number of face detector runs.
+    :param file_path:<str> Path of the video file
+    :param tracking_mode:<bool> Track the face between detections instead of using SKIP_FRAMES
+    :param roi_mode:<bool> Only process the region around the last face instead of the full frame
+    """
+    blink_detector = BlinkDetector(file_path, False, tracking_mode, roi_mode)
+    faces = []
+    blink_detector.face_detected.connect(faces.append)
+    start = time.perf_counter()
+    while blink_detector.check_frame():
+        pass
+    elapsed = time.perf_counter() - start
+    return np.array(faces, dtype=bool), elapsed, blink_detector.detector_runs
+
+
+def compare_face_modes(file_path):
+    """
+    Compares the face tracking and region of interest modes against full-frame SKIP_FRAMES detection on a video file.
+    Prints the frames per second of each mode and its face recall, using the frames where full-frame SKIP_FRAMES
+    detection found a face as reference.
+    :param file_path:<str> Path of the video file
+    """
+    reference = None
+    for name, tracking_mode, roi_mode in (("skip frames, full frame", False, False), ("skip frames, roi", False, True),
+                                          ("tracking, full frame", True, False), ("tracking, roi", True, True)):
+        faces, elapsed, detector_runs = run_detector(file_path, tracking_mode, roi_mode)
+        if reference is None:
+            reference = faces
+        recall = np.count_nonzero(reference & faces[:len(reference)]) / max(np.count_nonzero(reference), 1)
+        print(name + ": " + str(len(faces)) + " frames, " + str(round(len(faces) / elapsed, 1)) + " frames/s, " +
+              str(detector_runs) + " face detector runs, face found in " + str(np.count_nonzero(faces)) +
+              " frames, recall " + str(round(recall, 4)))
+
+
+def synthetic_frames(count, shape=SYNTHETIC_SHAPE):
+    """
+    Yields count frames of seeded noise. They contain no face, so they measure the preprocessing and face detector
+    cost of every frame on machines without recorded videos.
+    :param count:<int> Number of frames
+    :param shape:<tuple> Shape of each frame
+    """
+    rng = np.random.default_rng(0)
+    pool = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(SYNTHETIC_POOL)]
+    for i in range(count):
+        yield pool[i % SYNTHETIC_POOL]
+
+
+def source_frames(source, count=0, realtime=False):
+    """
+    Yields the frames of a video file, image directory or recorded session
+    :param source:<str> Path of the frame source
+    :param count:<int> Maximum number of frames, 0 for every frame
+    :param realtime:<bool> Replay at the pace the frames were recorded at instead of as fast as possible
+    """
+    frame_source = open_source(source, realtime)
+    frame_source.open()
+    try:
+        read = 0
+        while count == 0 or read < count:
+            success, frame = frame_source.read()
+            if not success:
+                return
+            read += 1
+            yield frame
+    finally:
+        frame_source.close()
+
+
+def blink_events(labels):
+    """
+    Returns a (N, 2) array of the first and last frame of every blink, a run of 'C' labels
+    :param labels:<array> Label of each frame
+    """
+    is_blink = np.concatenate(([False], labels == 'C', [False]))
+    edges = np.flatnonzero(is_blink[1:] != is_blink[:-1])
+    return edges.reshape(-1, 2) - (0, 1)
+
+
+def match_blinks(detections, events, delay):
+    """
+    Matches detected blinks to ground truth blinks. A detection matches a blink when it falls between the blink's first
+    frame and delay frames after its last frame, since the classifier needs the frames after a blink to recognize it.
+    Each blink matches at most one detection. Returns the precision and recall.
+    :param detections:<array> Frame indices where blinks were detected
+    :param events:<array> (N, 2) array of the first and last frame of each blink
+    :param delay:<int> Number of frames a detection may lag the end of a blink
+    """
+    matched = np.zeros(len(events), dtype=bool)
+    true_positives = 0
+    for frame in detections:
+        candidates = np.flatnonzero(~matched & (events[:, 0] <= frame) & (frame <= events[:, 1] + delay))
+        if len(candidates):
+            matched[candidates[0]] = True
+            true_positives += 1
+    precision = true_positives / len(detections) if len(detections) else 0.0
+    recall = true_positives / len(events) if len(events) else 0.0
+    return precision, recall
+
+
+def machine_info():
+    """
+    Returns the commit and machine a benchmark ran on, so results can be compared across commits and machines
+    """
+    def git(*command):
+        result = subprocess.run(("git",) + command, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+    return {'commit': git("rev-parse", "HEAD"), 'dirty': bool(git("status", "--porcelain", "--untracked-files=no")),
+            'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'opencv': cv2.__version__}
+
+
+def replay(frames, labels_path=None, tracking_mode=False, roi_mode=True):
+    """
+    Feeds frames through a blink detector's process_frame on the calling thread, without a Qt event loop. Returns a
+    dictionary with the frame rate, per-stage latency percentiles and, when labels are given, blink precision and
+    recall.
+    :param frames:<iterable> Frames to be processed
+    :param labels_path:<str> Path of a label file with the ground truth label of each frame, None to skip accuracy
+    :param tracking_mode:<bool> Track the face between detections instead of using SKIP_FRAMES
+    :param roi_mode:<bool> Only process the region around the last face instead of the full frame
+    """
+    blink_detector = BlinkDetector(None, False, tracking_mode, roi_mode)
+    latency = LatencyMonitor()
+    blink_detector.latency = latency
+    detections = []
+    faces = []
+    frame_count = 0
+    blink_detector.blink_detected.connect(lambda: detections.append(frame_count - 1))
+    blink_detector.face_detected.connect(faces.append)
+    frames = iter(frames)
+    start = time.perf_counter()
+    while True:
+        row = latency.begin()
+        frame = next(frames, None)
+        if frame is None:
+            break
+        latency.mark(row, 'capture')
+        frame_count += 1
+        blink_detector.process_frame(frame, row)
+    elapsed = time.perf_counter() - start
+    stats = latency.stats()
+    results = {'frames': frame_count, 'seconds': elapsed, 'frames_per_sec': frame_count / elapsed if elapsed else 0.0,
+               'face_frames': int(np.count_nonzero(faces)), 'detector_runs': blink_detector.detector_runs,
+               'blinks_detected': len(detections),
+               'latency_ms': {stage: stats[stage] for stage in stats if stats[stage]['count']}}
+    if labels_path is not None:
+        with open(labels_path, "r") as file:
+            labels = blinkdataset.parse_labels(file.readlines())[:frame_count]
+        events = blink_events(labels)
+        precision, recall = match_blinks(np.array(detections), events, blink_detector.EAR_FEATURE_SIZE)
+        results.update({'blinks_labelled': len(events), 'precision': precision, 'recall': recall})
+    return results
+
+
+def benchmark_replay(video, labels_path, synthetic, count, tracking_mode, roi_mode, output, realtime=False):
+    """
+    Replays a video or synthetic frames through the blink detector, prints the results and saves them as JSON together
+    with the commit and machine they were measured on
+    :param video:<str> Path of the video file, image directory or recorded session, None for synthetic frames
+    :param labels_path:<str> Path of the video's label file, None to skip accuracy
+    :param synthetic:<int> Number of synthetic frames when no video is given
+    :param count:<int> Maximum number of video frames, 0 for every frame
+    :param tracking_mode:<bool> Track the face between detections instead of using SKIP_FRAMES
+    :param roi_mode:<bool> Only process the region around the last face instead of the full frame
+    :param output:<str> Path of the JSON results file, None to only print them
+    :param realtime:<bool> Replay at the pace the frames were recorded at instead of as fast as possible
+    """
+    frames = synthetic_frames(synthetic) if video is None else source_frames(video, count, realtime)
+    results = replay(frames, labels_path, tracking_mode, roi_mode)
+    print(str(results['frames']) + " frames, " + str(round(results['frames_per_sec'], 1)) + " frames/s, face found in "
+          + str(results['face_frames']) + " frames, " + str(results['blinks_detected']) + " blinks detected")
+    for stage, stats in results['latency_ms'].items():
+        print("  " + stage + ": p50 " + str(round(stats['p50'], 3)) + " ms, p95 " + str(round(stats['p95'], 3)) +
+              " ms, p99 " + str(round(stats['p99'], 3)) + " ms")
+    if 'precision' in results:
+        print("blink precision " + str(round(results['precision'], 4)) + ", recall " + str(round(results['recall'], 4))
+              + " over " + str(results['blinks_labelled']) + " labelled blinks")
+    if output is not None:
+        config = {'video': video, 'labels': labels_path, 'synthetic_frames': synthetic if video is None else 0,
+                  'tracking_mode': tracking_mode, 'roi_mode': roi_mode, 'realtime': realtime}
+        with open(output, "w") as file:
+            json.dump({'machine': machine_info(), 'config': config, 'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       'results': results}, file, indent=2)
+        print("Saved results to " + output)
+
+
+def detect_blinks(model, ear):
+    """
+    Returns the frame indices where the blink detector would report a blink for a sequence of eye aspect ratio values,
+    applying the same classifier and the same wait of one feature vector between blinks
+    :param model:<BlinkModel> The blink model
+    :param ear:<array> Eye aspect ratio of each frame
+    """
+    size = model.feature_size
+    candidates = np.flatnonzero(model.predict(make_windows(ear, size)) == 'C') + size - 1
+    detections = []
+    last_blink = 0
+    for frame in candidates:
+        if frame + 1 > last_blink + size:
+            detections.append(frame)
+            last_blink = frame + 1
+    return np.array(detections, dtype=np.int64)
+
+
+def govern(ear, fps, governor):
+    """
+    Replays a sequence of eye aspect ratio values through a frame rate governor. Returns the values the blink detector
+    would see, with the last processed value repeated for every skipped frame, and the number of processed frames.
+    :param ear:<array> Eye aspect ratio of each frame
+    :param fps:<float> Frame rate the values were recorded at
+    :param governor:<FrameRateGovernor> The frame rate governor
+    """
+    governor.reset()
+    held = np.empty(len(ear))
+    processed = 0
+    last = 0.5
+    for i, value in enumerate(ear):
+        timestamp = i / fps
+        if governor.due(timestamp):
+            last = value
+            processed += 1
+            governor.update(True, value, timestamp)
+        held[i] = last
+    return held, processed
+
+
+def benchmark_governor(ear_path, fps, target_fps):
+    """
+    Compares blink detection on a replayed eye aspect ratio dataset with and without the frame rate governor. Prints the
+    share of frames the governor processed and how many of the blinks found at the full frame rate it still finds.
+    :param ear_path:<str> Path of the frame:ear text file
+    :param fps:<float> Frame rate the dataset was recorded at
+    :param target_fps:<float> Target frame rate of the governor
+    """
+    data = blinkdataset.load_cached(ear_path, None)
+    model = BlinkModel.load_cached(BlinkDetector.MODEL_PATH)
+    governor = FrameRateGovernor(target_fps)
+    frames = processed = full_blinks = governed_blinks = matched = 0
+    for video in np.unique(data['video']):
+        ear = np.asarray(data['ear'][data['video'] == video])
+        held, video_processed = govern(ear, fps, governor)
+        full = detect_blinks(model, ear)
+        governed = detect_blinks(model, held)
+        events = np.stack((full, full), axis=1)
+        matched += int(round(match_blinks(governed, events, model.feature_size)[1] * len(full)))
+        frames += len(ear)
+        processed += video_processed
+        full_blinks += len(full)
+        governed_blinks += len(governed)
+    print(str(frames) + " frames, " + str(processed) + " processed (" + str(round(100 * processed / frames, 1)) + "%)")
+    print(str(full_blinks) + " blinks at the full frame rate, " + str(governed_blinks) + " with the governor, " +
+          str(matched) + " found by both (" + str(round(100 * matched / max(full_blinks, 1), 1)) + "%)")
+
+
+def time_queries(function, queries, warm=False):
+    """
+    Calls a function with every query and returns the time of each call in microseconds
+    :param function:<function> The function to be timed
+    :param queries:<list> Arguments of the calls
+    :param warm:<bool> Call the function with each query once, untimed, right before the timed call
+    """
+    timings = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        if warm:
+            function(query)
+        start = time.perf_counter()
+        function(query)
+        timings[i] = time.perf_counter() - start
+    return timings * 1e6
+
+
+def benchmark_prediction(max_length):
+    """
+    Compares the word prediction paths on every prefix of every dictionary word up to max_length letters, typed in
+    order: the fuzzy fast_autocomplete search used before the prefix index, a bare prefix index lookup, and
+    WordPredictor's suggestions with a cold cache and with a warm one, where each query repeats the one just cached.
+    Also reports how often the suggestions differ from the fuzzy search.
+    :param max_length:<int> Maximum prefix length
+    """
+    from wordpredictor import WordPredictor, load_word_counts
+    words = load_word_counts()
+    queries = [word[:end] for word in words for end in range(1, min(len(word), max_length) + 1)]
+    predictor = WordPredictor()
+    fresh = WordPredictor()     # Separate predictor so the fuzzy search's own cache starts cold
+    paths = (("fuzzy search", lambda token: fresh.autoComplete.search(word=token, max_cost=3, size=3), False),
+             ("prefix index", predictor.prefix_index.lookup, False),
+             ("predictor, cold cache", predictor.predict_token, False),
+             ("predictor, warm cache", WordPredictor().predict_token, True))
+    print(str(len(queries)) + " queries, prefix index of " + str(len(predictor.prefix_index)) + " prefixes")
+    for name, function, warm in paths:
+        timings = time_queries(function, queries, warm)
+        print(name + ": median " + str(round(float(np.median(timings)), 2)) + " us, p99 " +
+              str(round(float(np.percentile(timings, 99)), 2)) + " us, max " + str(round(float(timings.max()), 1)) +
+              " us")
+    different = 0
+    for query in set(queries):
+        fuzzy = [result[0] for result in predictor.autoComplete.search(word=query, max_cost=3, size=3)]
+        different += list(predictor.predict_token(query)) != fuzzy + [""] * (3 - len(fuzzy))
+    print(str(different) + " of " + str(len(set(queries))) + " prefixes get different suggestions than the fuzzy " +
+          "search")
+
+
+STARTUP_MODULES = ("gui", "blinkdetector", "symbolmanager", "PySide2.QtWidgets", "cv2", "dlib", "sklearn", "pyttsx3",
+                   "fast_autocomplete")    # Modules whose cold import time is reported by the startup benchmark
+
+
+def time_import(module):
+    """
+    Returns the time in seconds a fresh interpreter takes to import a module
+    :param module:<str> Name of the module
+    """
+    code = "import time; t = time.perf_counter(); import " + module + "; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def time_startup():
+    """
+    Starts the application with the startup benchmark flag set. Returns the wall time until the process exited and the
+    import and first paint times reported by main.py, all in seconds.
+    """
+    env = dict(os.environ, BLINK2TALK_STARTUP_BENCHMARK="1")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "main.py"], capture_output=True, text=True, env=env)
+    elapsed = time.perf_counter() - start
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process_s'] = elapsed
+    return timings
+
+
+def benchmark_startup(runs):
+    """
+    Prints the median cold import time of the application's heavy modules and the median import, first paint and
+    process times of the application
+    :param runs:<int> Number of runs per measurement
+    """
+    for module in STARTUP_MODULES:
+        timings = [time_import(module) for _ in range(runs)]
+        if None in timings:
+            print("import " + module + ": failed")
+        else:
+            print("import " + module + ": " + str(round(float(np.median(timings)) * 1000, 1)) + " ms")
+    startups = [time_startup() for _ in range(runs)]
+    for key in ('import_s', 'first_paint_s', 'process_s'):
+        print("application " + key[:-2].replace("_", " ") + ": " +
+              str(round(float(np.median([startup[key] for startup in startups])) * 1000, 1)) + " ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Blink detection pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    face_modes_parser = subparsers.add_parser("face-modes",
+                                              help="compare face tracking and roi modes against SKIP_FRAMES detection")
+    face_modes_parser.add_argument("video", help="video file to replay")
+    replay_parser = subparsers.add_parser("replay", help="replay frames through the blink detector without a GUI")
+    replay_parser.add_argument("video", nargs="?",
+                               help="video file, image directory or recorded session, synthetic frames if omitted")
+    replay_parser.add_argument("--labels", help="ground truth label file of the video for blink precision and recall")
+    replay_parser.add_argument("--synthetic", type=int, default=300, metavar="N",
+                               help="number of synthetic frames replayed when no video is given")
+    replay_parser.add_argument("--frames", type=int, default=0, help="maximum number of video frames, 0 for all")
+    replay_parser.add_argument("--realtime", action="store_true", help="replay at the recorded pace")
+    replay_parser.add_argument("--tracking", action="store_true", help="track the face between detections")
+    replay_parser.add_argument("--full-frame", action="store_true", help="disable the region of interest")
+    replay_parser.add_argument("-o", "--output", default="benchmark_replay.json", help="JSON results file to write")
+    governor_parser = subparsers.add_parser("governor",
+                                            help="check the frame rate governor against an eye aspect ratio dataset")
+    governor_parser.add_argument("--ear", default=blinkdataset.EAR_PATH, help="frame:ear text file to replay")
+    governor_parser.add_argument("--fps", type=float, default=30, help="frame rate the dataset was recorded at")
+    governor_parser.add_argument("--target-fps", type=float, default=FrameRateGovernor.TARGET_FPS,
+                                 help="target frame rate of the governor")
+    prediction_parser = subparsers.add_parser("prediction", help="compare prefix index and fuzzy word prediction")
+    prediction_parser.add_argument("--max-length", type=int, default=6, help="longest prefix typed per word")
+    startup_parser = subparsers.add_parser("startup", help="measure module import and application first paint times")
+    startup_parser.add_argument("-n", "--runs", type=int, default=5, help="number of runs per measurement")
+    args = parser.parse_args()
+    if args.command == "face-modes":
+        compare_face_modes(args.video)
+    elif args.command == "replay":
+        benchmark_replay(args.video, args.labels, args.synthetic, args.frames, args.tracking, not args.full_frame,
+                         args.output, args.realtime)
+    elif args.command == "governor":
+        benchmark_governor(args.ear, args.fps, args.target_fps)
+    elif args.command == "prediction":
+        benchmark_prediction(args.max_length)
+    elif args.command == "startup":
+        benchmark_startup(args.runs)
@@ -0,0 +1,225 @@
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
+
+EAR_PATH = "resources/datasets/ear_output_eyeblink8.txt"    # Default frame:ear dataset
+LABEL_PATH = "resources/datasets/labels_eyeblink8.txt"  # Default ground truth labels, fourth field of each line
+CHUNK_LINES = 65536     # Number of lines parsed at a time when streaming a dataset
+CACHE_DIR = "resources/datasets/cache"  # Directory holding binary copies of the text datasets
+CACHE_VERSION = 1   # Incremented whenever the binary dataset layout changes
+
+
+def parse_frames_ear(lines):
+    """
+    Parses frame:ear lines into an array of frame indices and an array of eye aspect ratio values
+    :param lines:<list> Lines of a frame:ear text file
+    """
+    values = np.fromstring("".join(lines).replace(":", " "), dtype=np.float64, sep=" ").reshape(-1, 2)
+    return values[:, 0].astype(np.int64), values[:, 1]
+
+
+def parse_ear(lines):
+    """
+    Parses frame:ear lines into an array of eye aspect ratio values
+    :param lines:<list> Lines of a frame:ear text file
+    """
+    return parse_frames_ear(lines)[1]
+
+
+def parse_labels(lines):
+    """
+    Parses colon separated label lines into an array holding the fourth field of each line
+    :param lines:<list> Lines of a label text file
+    """
+    return np.array([line.rstrip().split(":")[3] for line in lines])
+
+
+def make_windows(ear, size):
+    """
+    Returns a read-only (N - size + 1, size) view of every window of consecutive eye aspect ratio values, ordered from
+    newest to oldest like the blink detector's feature vector. Row i is centred on value i + size // 2.
+    :param ear:<array> Eye aspect ratio values
+    :param size:<int> Number of values per window
+    """
+    ear = np.ascontiguousarray(ear)
+    count = max(len(ear) - size + 1, 0)
+    windows = np.lib.stride_tricks.as_strided(ear, shape=(count, size), strides=(ear.strides[0],) * 2,
+                                              writeable=False)
+    return windows[:, ::-1]
+
+
+def select_windows(labels, size, last_blink=0):
+    """
+    Chooses the training windows in a label array. Every blink ('C') window is kept, and non-blink ('X') windows are
+    kept only when more than size frames have passed since the last blink. Returns a mask over the window centres
+    labels[size // 2:len(labels) - size // 2] and the index of the last blink.
+    :param labels:<array> Label of each frame
+    :param size:<int> Number of values per window
+    :param last_blink:<int> Index of the last blink before the first window centre
+    """
+    half = size // 2
+    centres = np.arange(half, len(labels) - half)
+    centre_labels = labels[half:len(labels) - half]
+    is_blink = centre_labels == 'C'
+    # Index of the most recent blink up to and including each centre, and strictly before each centre
+    blinks = np.maximum.accumulate(np.where(is_blink, centres, last_blink)) if len(centres) else centres
+    previous = np.concatenate(([last_blink], blinks[:-1]))
+    mask = is_blink | ((centre_labels == 'X') & (previous + size < centres))
+    return mask, (int(blinks[-1]) if len(blinks) else last_blink)
+
+
+def iter_windows(ear_paths, label_paths, size, chunk_lines=CHUNK_LINES):
+    """
+    Streams training windows and labels from one or more datasets, holding only chunk_lines lines of each file in
+    memory at a time. Yields (windows, labels) array pairs.
+    :param ear_paths:<list> Paths of frame:ear text files
+    :param label_paths:<list> Paths of the matching label text files
+    :param size:<int> Number of values per window
+    :param chunk_lines:<int> Number of lines parsed at a time
+    """
+    half = size // 2
+    for ear_path, label_path in zip(ear_paths, label_paths):
+        with open(ear_path, "r") as ear_file, open(label_path, "r") as label_file:
+            ear_tail = np.empty(0)  # Values carried over so windows can span chunk boundaries
+            label_tail = np.empty(0, dtype=str)
+            offset = 0  # Index of the first carried over value in the file
+            last_blink = 0
+            while True:
+                ear_lines = list(itertools.islice(ear_file, chunk_lines))
+                if not ear_lines:
+                    break
+                ear = np.concatenate((ear_tail, parse_ear(ear_lines)))
+                labels = np.concatenate((label_tail, parse_labels(itertools.islice(label_file, len(ear_lines)))))
+                mask, last_blink = select_windows(labels, size, last_blink - offset)
+                last_blink += offset
+                rows = np.flatnonzero(mask)
+                yield make_windows(ear, size)[rows], labels[rows + half]
+                keep = min(size - 1, len(ear))
+                offset += len(ear) - keep
+                ear_tail, label_tail = ear[len(ear) - keep:], labels[len(labels) - keep:]
+
+
+def source_stats(paths):
+    """
+    Returns the size and modification time of each source file, used to detect when a cached dataset is stale
+    :param paths:<list> Paths of the source files, None entries are skipped
+    """
+    stats = {}
+    for path in paths:
+        if path is not None:
+            stat = os.stat(path)
+            stats[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def cache_path(ear_path, label_path, cache_dir=CACHE_DIR):
+    """
+    Returns the path of the binary dataset cached for a frame:ear text file and its label file. The file name ends
+    with a hash of the absolute source paths, so datasets with the same file names in different directories are cached
+    separately.
+    :param ear_path:<str> Path of the frame:ear text file
+    :param label_path:<str> Path of the matching label text file, or None if the dataset is unlabelled
+    :param cache_dir:<str> Directory holding the cached datasets
+    """
+    name = os.path.splitext(os.path.basename(ear_path))[0]
+    if label_path is not None:
+        name += "." + os.path.splitext(os.path.basename(label_path))[0]
+    sources = [os.path.abspath(path) if path is not None else None for path in (ear_path, label_path)]
+    key = hashlib.sha1(json.dumps(sources).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, name + "." + key + ".npy")
+
+
+def build_cache(ear_path, label_path, output_path):
+    """
+    Converts a text dataset into a structured .npy array with one record per frame holding the video index, frame
+    index, eye aspect ratio and label. Video indices count the places where the frame index restarts, since a dataset
+    concatenates several videos. A JSON sidecar records the source files the array was built from.
+    :param ear_path:<str> Path of the frame:ear text file
+    :param label_path:<str> Path of the matching label text file, or None if the dataset is unlabelled
+    :param output_path:<str> Path of the .npy file to be written
+    """
+    with open(ear_path, "r") as file:
+        frames, ear = parse_frames_ear(file.readlines())
+    if label_path is None:
+        labels = np.full(len(ear), b"")
+    else:
+        with open(label_path, "r") as file:
+            labels = np.char.encode(parse_labels(file.readlines()))
+    video = np.concatenate(([0], np.cumsum(frames[1:] <= frames[:-1])))
+    dtype = np.dtype([('video', '<u2'), ('frame', '<u4'), ('ear', '<f8'), ('label', labels.dtype)])
+    data = np.empty(len(ear), dtype=dtype)
+    data['video'], data['frame'], data['ear'], data['label'] = video, frames, ear, labels[:len(ear)]
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    # Written under a temporary name and moved into place, so an array another caller has memory-mapped is not
+    # truncated
+    temp_path = output_path[:-len(".npy")] + ".tmp.npy"
+    np.save(temp_path, data)
+    os.replace(temp_path, output_path)
+    with open(os.path.splitext(output_path)[0] + ".json", "w") as file:
+        json.dump({'version': CACHE_VERSION, 'sources': source_stats([ear_path, label_path])}, file)
+
+
+def load_cached(ear_path=EAR_PATH, label_path=LABEL_PATH, cache_dir=CACHE_DIR):
+    """
+    Returns a text dataset as a memory-mapped structured array with 'video', 'frame', 'ear' and 'label' fields. The
+    binary copy is rebuilt whenever the text files have changed since it was written.
+    :param ear_path:<str> Path of the frame:ear text file
+    :param label_path:<str> Path of the matching label text file, or None if the dataset is unlabelled
+    :param cache_dir:<str> Directory holding the cached datasets
+    """
+    output_path = cache_path(ear_path, label_path, cache_dir)
+    header = {}
+    try:
+        with open(os.path.splitext(output_path)[0] + ".json", "r") as file:
+            header = json.load(file)
+    except (OSError, ValueError):
+        pass
+    if header.get('version') != CACHE_VERSION or header.get('sources') != source_stats([ear_path, label_path]) or \
+            not os.path.exists(output_path):
+        build_cache(ear_path, label_path, output_path)
+    return np.load(output_path, mmap_mode='r')
+
+
+def load_data(ear_paths=(EAR_PATH,), label_paths=(LABEL_PATH,), size=13, chunk_lines=CHUNK_LINES, use_cache=True):
+    """
+    Loads training windows and labels from one or more eye aspect ratio datasets. Returns an (N, size) array of windows
+    and an array of N labels. Cached binary datasets are used unless use_cache is false, in which case the text files
+    are streamed chunk_lines lines at a time.
+    :param ear_paths:<list> Paths of frame:ear text files
+    :param label_paths:<list> Paths of the matching label text files
+    :param size:<int> Number of values per window
+    :param chunk_lines:<int> Number of lines parsed at a time when not using the cache
+    :param use_cache:<bool> Load the datasets through their memory-mapped binary copies
+    """
+    if use_cache:
+        return load_grouped_data(ear_paths, label_paths, size)[:2]
+    windows, labels = [np.empty((0, size))], [np.empty(0, dtype=str)]
+    for chunk_windows, chunk_labels in iter_windows(ear_paths, label_paths, size, chunk_lines):
+        windows.append(chunk_windows)
+        labels.append(chunk_labels)
+    return np.concatenate(windows), np.concatenate(labels)
+
+
+def load_grouped_data(ear_paths=(EAR_PATH,), label_paths=(LABEL_PATH,), size=13):
+    """
+    Loads training windows, labels and source video indices from one or more cached eye aspect ratio datasets. Video
+    indices are unique across datasets so they can be used as cross-validation groups. Returns an (N, size) array of
+    windows, an array of N labels and an array of N video indices.
+    :param ear_paths:<list> Paths of frame:ear text files
+    :param label_paths:<list> Paths of the matching label text files
+    :param size:<int> Number of values per window
+    """
+    windows, labels, groups = [np.empty((0, size))], [np.empty(0, dtype=str)], [np.empty(0, dtype=np.int64)]
+    video_offset = 0
+    for ear_path, label_path in zip(ear_paths, label_paths):
+        data = load_cached(ear_path, label_path)
+        data_labels = np.char.decode(data['label'])
+        rows = np.flatnonzero(select_windows(data_labels, size)[0])
+        windows.append(make_windows(data['ear'], size)[rows])
+        labels.append(data_labels[rows + size // 2])
+        groups.append(data['video'][rows + size // 2].astype(np.int64) + video_offset)
+        if len(data):
+            video_offset += int(data['video'][-1]) + 1
+    return np.concatenate(windows), np.concatenate(labels), np.concatenate(groups)
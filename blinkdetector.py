@@ -1,11 +1,30 @@
+import threading
 import time
 import dlib
 import cv2
 import pickle
+import numpy as np
 from PySide2.QtCore import QObject, Signal, Slot
-from sklearn import svm
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.model_selection import train_test_split
+import blinkdataset
+from blinkmodel import BlinkModel
+from earbuffer import EarBuffer
+from framesource import open_source
+
+LANDMARK_MODEL_PATH = "resources/shape_predictor_68_face_landmarks.dat"   # dlib 68 point landmark predictor
+_face_models = None     # (face detector, landmark detector) shared by every blink detector in the process
+_face_models_lock = threading.Lock()
+
+
+def load_face_models():
+    """
+    Loads the dlib face detector and landmark predictor once per process and returns them. Safe to call from several
+    threads, later callers wait for the first load to finish.
+    """
+    global _face_models
+    with _face_models_lock:
+        if _face_models is None:
+            _face_models = (dlib.get_frontal_face_detector(), dlib.shape_predictor(LANDMARK_MODEL_PATH))
+        return _face_models
 
 
 class BlinkDetector(QObject):
@@ -19,28 +38,79 @@ class BlinkDetector(QObject):
     LEFT_EYE_OFFSET = 36    # Starting position for the left eye in landmark array
     RIGHT_EYE_OFFSET = 42   # Starting position for the right eye in landmark array
     SKIP_FRAMES = 2     # Number of frames to skip for face detector
+    REDETECT_INTERVAL = 30  # Maximum number of frames the face is tracked before the face detector runs again
+    TRACKING_QUALITY_THRESHOLD = 7.0    # Minimum correlation tracker confidence to keep tracking without detection
+    ROI_MARGIN = 0.6    # Margin added around the landmarks on each side of the region of interest, relative to the face
+    ROI_INNER_MARGIN = 0.15     # Margin the landmarks must keep from the region of interest's edges before it moves
     DOWNSIZE_RATIO = 2  # The ratio to downsize video frames
     EAR_THRESHOLD = 0.25    # Threshold for eye aspect ratio
     EAR_FEATURE_SIZE = 13   # Size of eye aspect ratio array
     EAR_FEATURE_SIZE_HALF = 6   # Half size of eye aspect ratio array
+    MODEL_PATH = 'resources/blink_model.npz'   # Versioned blink model artifact
+    EYE_INDICES = np.array([np.arange(6) + LEFT_EYE_OFFSET,
+                            np.arange(6) + RIGHT_EYE_OFFSET])   # Landmark indices of the left and right eye
 
     face_detected = Signal(bool)
     blink_detected = Signal()
 
-    def __init__(self, file_path, draw_mode):
+    def __init__(self, file_path, draw_mode, tracking_mode=False, roi_mode=True, lazy=False):
         super(BlinkDetector, self).__init__()
+        self._file_path = file_path     # Camera index, path or FrameSource to read frames from, None for no source
         self._draw_mode = draw_mode  # Enable/disable drawing of landmarks
-        self._ear_feature = []   # Eye aspect ratio feature array
+        self._tracking_mode = tracking_mode     # Track the face between detections instead of using SKIP_FRAMES
+        self._roi_mode = roi_mode   # Only process the region around the last face instead of the full frame
+        self._roi = None    # (left, top, right, bottom) region of interest in frame coordinates, None for full frame
         self._faces = []     # Array to hold detected faces
+        self.face_found = False     # True if a face was found in the most recently processed frame
         self._frame_count = 0    # Video frame counter
+        self._processed_count = 0   # Counter of processed frames, which the SKIP_FRAMES face detector schedule follows
+        self.detector_runs = 0  # Number of times the face detector has run
+        self._tracking = False  # True while the correlation tracker follows a detected face
+        self._last_detection_frame = 0  # Last frame that the face detector ran
         self.frames_per_sec = 0     # Frames per second processed by blink detector
         self._last_blink_frame = 0   # Last frame that a blink was detected
-        with open('resources/blink_model.pk1', 'rb') as f:
-            self._blink_svm = pickle.load(f)
-        self._face_detector = dlib.get_frontal_face_detector()
-        self._landmark_detector = dlib.shape_predictor("resources/shape_predictor_68_face_landmarks.dat")
-        self._cap = cv2.VideoCapture(file_path)  # filePath = 0 for front cam
+        self._blink_svm = None     # scikit-learn SVM, only set while training
+        self._blink_model = None    # NumPy blink classifier
+        self._ear_feature = EarBuffer(BlinkDetector.EAR_FEATURE_SIZE)   # Eye aspect ratio feature array, newest first
+        self._face_detector = None
+        self._landmark_detector = None
+        self._face_tracker = None
+        self._source = None     # Frame source, opened by open()
         self._start_time = time.time()
+        self.latency = None     # LatencyMonitor recording the time each frame spends in every stage, None to disable
+        self._latency_row = None    # Latency monitor row of the frame being processed
+        self.blink_latency_row = None   # Latency monitor row of the frame in which the last blink was detected
+        if not lazy:
+            self.open()
+
+    def load_models(self):
+        """
+        Loads the blink model, face detector and landmark predictor. The models are cached per process, so only the
+        first blink detector pays the loading time.
+        """
+        self._blink_model = BlinkModel.load_cached(BlinkDetector.MODEL_PATH)
+        self._ear_feature = EarBuffer(self._blink_model.feature_size)
+        self._face_detector, self._landmark_detector = load_face_models()
+        self._face_tracker = dlib.correlation_tracker()
+
+    def open(self):
+        """
+        Loads the models if needed and opens the video source if it is not already open
+        """
+        if self._blink_model is None:
+            self.load_models()
+        if self._source is None and self._file_path is not None:
+            self._source = open_source(self._file_path)
+            self._source.open()
+            self._start_time = time.time()
+
+    def close(self):
+        """
+        Releases the video source so other applications can use the camera. open() reacquires it.
+        """
+        if self._source is not None:
+            self._source.close()
+            self._source = None
 
     @staticmethod
     def scale_dlib_rect(rect, scale):
@@ -56,34 +126,110 @@ class BlinkDetector(QObject):
         return dlib.rectangle(left, top, right, bottom)
 
     @staticmethod
-    def calc_ear(landmarks, offset):
+    def landmarks_to_array(landmarks):
+        """
+        Converts detected landmarks into an (N, 2) array of landmark positions
+        :param landmarks:<full_object_detection> Facial landmarks found by the landmark detector
+        """
+        return np.array([(point.x, point.y) for point in landmarks.parts()], dtype=np.float64)
+
+    @staticmethod
+    def calc_ear(points):
+        """
+        Calculates the eye aspect ratio of the left and right eye with landmark positions
+        :param points:<array> (N, 2) array holding facial landmark positions
+        """
+        return BlinkDetector.calc_ear_batch(points[np.newaxis])[0]
+
+    @staticmethod
+    def calc_ear_batch(points):
+        """
+        Calculates the eye aspect ratio of the left and right eye for a stack of landmark arrays. Returns an (M, 2)
+        array holding the left and right eye aspect ratio for each landmark array.
+        :param points:<array> (M, N, 2) array holding M sets of facial landmark positions
+        """
+        eyes = points[:, BlinkDetector.EYE_INDICES]     # (M, 2, 6, 2) eye landmark positions
+        vertical = np.linalg.norm(eyes[:, :, [1, 2]] - eyes[:, :, [5, 4]], axis=-1).sum(axis=-1)
+        horizontal = np.linalg.norm(eyes[:, :, 0] - eyes[:, :, 3], axis=-1)
+        return vertical / (2.0 * horizontal)
+
+    @property
+    def last_ear(self):
+        """
+        The eye aspect ratio of the most recently processed frame
+        """
+        return self._ear_feature[0]
+
+    def reset(self, frame_count=0):
+        """
+        Clears all per-video state so the blink detector can process another video
+        :param frame_count:<int> Number of frames that precede the next processed frame in the video
+        """
+        self._ear_feature.clear()
+        self._faces = []
+        self.face_found = False
+        self._frame_count = frame_count
+        self._processed_count = frame_count
+        self.detector_runs = 0
+        self._tracking = False
+        self._last_detection_frame = frame_count
+        self._roi = None
+        self._last_blink_frame = frame_count
+        self.frames_per_sec = 0
+        self._start_time = time.time()
+
+    def read_frame(self):
+        """
+        Reads the next frame from the video source. Returns a success flag and the frame.
+        """
+        if self._source is None:
+            return False, None
+        return self._source.read()
+
+    def grab_frame(self):
+        """
+        Advances the video source to the next frame without decoding it. Returns a success flag.
+        """
+        return self._source is not None and self._source.grab()
+
+    def retrieve_frame(self):
         """
-        Calculates eye aspect ratio with landmark positions
-        :param landmarks:<array> Array holding facial landmarks
-        :param offset:<int> Starting position in the landmarks array for either left or right eye
+        Decodes the frame last grabbed from the video source. Returns a success flag and the frame.
         """
-        a = ((landmarks.part(1 + offset).x - landmarks.part(5 + offset).x) ** 2 +
-             (landmarks.part(1 + offset).y - landmarks.part(5 + offset).y) ** 2) ** (1 / 2)
-        b = ((landmarks.part(2 + offset).x - landmarks.part(4 + offset).x) ** 2 +
-             (landmarks.part(2 + offset).y - landmarks.part(4 + offset).y) ** 2) ** (1 / 2)
-        c = ((landmarks.part(0 + offset).x - landmarks.part(3 + offset).x) ** 2 +
-             (landmarks.part(0 + offset).y - landmarks.part(3 + offset).y) ** 2) ** (1 / 2)
-        return (a + b) / (2.0 * c)
+        return self._source.retrieve()
 
     @Slot()
     def check_frame(self):
         """
         Check to see if there is a frame available to be read from the video source
         """
-        success, frame = self._cap.read()
+        if not self.grab_frame():
+            return False
+        row = self.latency.begin() if self.latency is not None else None
+        success, frame = self.retrieve_frame()
         if success:
-            self.process_frame(frame)
-        return success
+            self.mark_latency(row, 'capture')
+            self.process_frame(frame, row)
+        return True     # A frame that could not be decoded is dropped, the source still has frames
+
+    def mark_latency(self, row, stage):
+        """
+        Records that a frame has finished a stage when latency monitoring is enabled
+        :param row:<int> Latency monitor row of the frame, None if the frame is not being timed
+        :param stage:<str> Name of the finished stage
+        """
+        if row is not None:
+            self.latency.mark(row, stage)
 
     def train_svm(self):
         """
         Train the blink support vector machine using a dataset
         """
+        # scikit-learn is only needed for training, the blink model itself loads without it
+        from sklearn import svm
+        from sklearn.metrics import classification_report, confusion_matrix
+        from sklearn.model_selection import train_test_split
+
         # Load and preprocess data
         X, y = self.load_data()
         X_train, X_test, y_train, y_test = train_test_split(X, y, random_state=0, test_size=0.1, shuffle=True)
@@ -100,43 +246,16 @@ class BlinkDetector(QObject):
         # Save SVM
         with open('resources/blink_model.pk1', 'wb') as f:
             pickle.dump(self._blink_svm, f)
+        self._blink_model = BlinkModel.from_svc(self._blink_svm)
+        self._blink_model.save(BlinkDetector.MODEL_PATH)
+        self._ear_feature = EarBuffer(self._blink_model.feature_size)
 
     @staticmethod
     def load_data():
         """
         Load eye aspect ratio data from a text file for support vector machine training
         """
-        x = []
-        y = []
-        ear = []
-        label = []
-        # Get dataset from text files
-        with open("resources/datasets/labels_eyeblink8.txt", "r") as file:
-            lines = file.readlines()
-            for line in lines:
-                line = line.rstrip()
-                line = line.split(":")
-                y.append(line[3])
-        with open("resources/datasets/ear_output_eyeblink8.txt", "r") as file:
-            lines = file.readlines()
-            for line in lines:
-                line = line.rstrip()
-                line = line.split(":")
-                x.append(float(line[1]))
-            last_blink = 0  # The index that a blink last occurred
-            # Prepare feature vectors and labels
-            for i in range(BlinkDetector.EAR_FEATURE_SIZE_HALF, len(x) - BlinkDetector.EAR_FEATURE_SIZE_HALF):
-                temp = []
-                for j in range(-BlinkDetector.EAR_FEATURE_SIZE_HALF, BlinkDetector.EAR_FEATURE_SIZE_HALF + 1):
-                    temp.append(x[i-j])
-                if y[i] == 'X' and last_blink + BlinkDetector.EAR_FEATURE_SIZE < i:
-                    ear.append(temp)
-                    label.append(y[i])
-                elif y[i] == 'C':
-                    last_blink = i
-                    ear.append(temp)
-                    label.append(y[i])
-        return ear, label
+        return blinkdataset.load_data(size=BlinkDetector.EAR_FEATURE_SIZE)
 
     def calc_data(self):
         """
@@ -164,41 +283,123 @@ class BlinkDetector(QObject):
         """
         Feeds a vector of eye aspect ratio values to a support vector machine to classify blinks
         """
-        if len(self._ear_feature) == BlinkDetector.EAR_FEATURE_SIZE and \
-                self._frame_count > self._last_blink_frame + BlinkDetector.EAR_FEATURE_SIZE:
-            if self._blink_svm.predict([self._ear_feature]) == 'C':
+        if len(self._ear_feature) == self._ear_feature.size and \
+                self._frame_count > self._last_blink_frame + self._ear_feature.size:
+            is_blink = self._blink_model.predict(self._ear_feature.view()[np.newaxis])[0] == 'C'
+            self.mark_latency(self._latency_row, 'classify')
+            if is_blink:
+                self.blink_latency_row = self._latency_row
                 self.blink_detected.emit()
+                self.mark_latency(self._latency_row, 'emit')
                 self._last_blink_frame = self._frame_count
 
-    def process_frame(self, frame):
+    def skip_frames(self, count):
+        """
+        Accounts for frames that were captured but not processed. The last eye aspect ratio is repeated for each one, so
+        the feature vector keeps one value per video frame as the classifier expects.
+        :param count:<int> Number of skipped frames
+        """
+        ear = self._ear_feature[0] if len(self._ear_feature) else 0.5
+        for _ in range(count):
+            self._frame_count += 1
+            self._ear_feature.push(ear)
+
+    def detect_faces(self, gray_small):
+        """
+        Runs the face detector on a downsized frame
+        :param gray_small:<array> The downsized grayscale frame
+        """
+        self.detector_runs += 1
+        self._last_detection_frame = self._frame_count
+        return self._face_detector(gray_small, 0)  # up-sample 0 times (less accurate, faster)
+
+    def track_faces(self, gray_small):
+        """
+        Follows the last detected face with a correlation tracker. The face detector only runs again when the tracking
+        confidence drops below TRACKING_QUALITY_THRESHOLD or after REDETECT_INTERVAL frames.
+        :param gray_small:<array> The downsized grayscale frame
+        """
+        if self._tracking and self._frame_count - self._last_detection_frame < BlinkDetector.REDETECT_INTERVAL:
+            if self._face_tracker.update(gray_small) >= BlinkDetector.TRACKING_QUALITY_THRESHOLD:
+                pos = self._face_tracker.get_position()
+                return [dlib.rectangle(int(pos.left()), int(pos.top()), int(pos.right()), int(pos.bottom()))]
+        faces = self.detect_faces(gray_small)
+        self._tracking = len(faces) >= 1
+        if self._tracking:
+            self._face_tracker.start_track(gray_small, faces[0])
+        return faces
+
+    def update_roi(self, points, frame_shape):
+        """
+        Moves the region of interest so it surrounds the face with a margin of ROI_MARGIN. The region only moves when
+        the landmarks come within ROI_INNER_MARGIN of its edges, so the face detector and tracker coordinates stay
+        valid while the face is still. Moving the region resets the detected faces and the tracker.
+        :param points:<array> (N, 2) array of landmark positions in frame coordinates
+        :param frame_shape:<tuple> Shape of the full frame
+        """
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        w, h = x1 - x0, y1 - y0
+        frame_height, frame_width = frame_shape[:2]
+        if self._roi is not None:
+            left, top, right, bottom = self._roi
+            mx, my = w * BlinkDetector.ROI_INNER_MARGIN, h * BlinkDetector.ROI_INNER_MARGIN
+            # Edges clipped to the frame border never force the region to move
+            if (x0 - mx >= left or left == 0) and (y0 - my >= top or top == 0) and \
+                    (x1 + mx <= right or right == frame_width) and (y1 + my <= bottom or bottom == frame_height):
+                return
+        mx, my = w * BlinkDetector.ROI_MARGIN, h * BlinkDetector.ROI_MARGIN
+        self._roi = (max(int(x0 - mx), 0), max(int(y0 - my), 0),
+                     min(int(x1 + mx) + 1, frame_width), min(int(y1 + my) + 1, frame_height))
+        self._faces = []
+        self._tracking = False
+
+    def process_frame(self, frame, latency_row=None):
         """
         Applies face detection, landmark detection, and blink detection on a retrieved frame
+        :param frame:<array> The BGR or 2-D grayscale frame to be processed
+        :param latency_row:<int> Latency monitor row the frame's stage timestamps are recorded in, None to not time it
         """
+        self._latency_row = latency_row
         self._frame_count += 1
+        self._processed_count += 1
+        frame_shape = frame.shape
+        # Crop to the region around the last face, or process the full frame when the face was lost
+        left, top = 0, 0
+        if self._roi is not None:
+            left, top, right, bottom = self._roi
+            frame = frame[top:bottom, left:right]
         # Frame preprocessing
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         gray_small = cv2.resize(gray, (0, 0), fx=1.0 / BlinkDetector.DOWNSIZE_RATIO,
                                 fy=1.0 / BlinkDetector.DOWNSIZE_RATIO)
-        if self._frame_count % BlinkDetector.SKIP_FRAMES == 0 or len(self._faces) == 0:
-            self._faces = self._face_detector(gray_small, 0)  # up-sample 0 times (less accurate, faster)
+        self.mark_latency(latency_row, 'preprocess')
+        # The SKIP_FRAMES schedule counts processed frames, since frames skipped at a steady rate could otherwise keep
+        # every processed frame off the schedule
+        if self._tracking_mode:
+            self._faces = self.track_faces(gray_small)
+        elif self._processed_count % BlinkDetector.SKIP_FRAMES == 0 or len(self._faces) == 0:
+            self._faces = self.detect_faces(gray_small)
+        self.mark_latency(latency_row, 'detect')
         # If a face is detected
-        if len(self._faces) >= 1:
+        self.face_found = len(self._faces) >= 1
+        if self.face_found:
             face = self.scale_dlib_rect(self._faces[0], BlinkDetector.DOWNSIZE_RATIO)
-            landmarks = self._landmark_detector(gray, face)
-            ear_left = self.calc_ear(landmarks, BlinkDetector.LEFT_EYE_OFFSET)
-            ear_right = self.calc_ear(landmarks, BlinkDetector.RIGHT_EYE_OFFSET)
-            self._ear_feature.insert(0, (ear_left + ear_right) / 2.0)
+            points = self.landmarks_to_array(self._landmark_detector(gray, face))
+            self.mark_latency(latency_row, 'landmark')
+            self._ear_feature.push(self.calc_ear(points).mean())
+            self.mark_latency(latency_row, 'ear')
             self.detect_blinks_svm()
+            if self._roi_mode:
+                self.update_roi(points + (left, top), frame_shape)
             if self._draw_mode:
-                for i in range(landmarks.num_parts):
-                    cv2.circle(gray, (landmarks.part(i).x, landmarks.part(i).y), 1, (0, 255, 255), -1)
+                for point in points.astype(int).tolist():
+                    cv2.circle(gray, tuple(point), 1, (0, 255, 255), -1)
             self.face_detected.emit(True)
         else:
-            self._ear_feature.insert(0, 0.5)
+            self._ear_feature.push(0.5)
+            self._roi = None
             self.face_detected.emit(False)
-        # Update feature vector
-        if len(self._ear_feature) >= BlinkDetector.EAR_FEATURE_SIZE:
-            self._ear_feature.pop()
         self.frames_per_sec = self._frame_count / (time.time() - self._start_time)
         if self._draw_mode:
             cv2.imshow("Output", gray)
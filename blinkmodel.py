@@ -0,0 +1,192 @@
+import argparse
+import functools
+import json
+import os
+import pickle
+import time
+import numpy as np
+from blinkdataset import make_windows, parse_ear
+
+
+class BlinkModel:
+    """
+    The BlinkModel class holds the parameters of a trained binary blink classifier as plain NumPy arrays and evaluates
+    its decision function directly. RBF support vector machines keep their support vectors and dual coefficients, while
+    linear models are stored as a single weight vector with a linear kernel. Classifying the single feature vector
+    produced for every frame this way avoids the input validation and dispatch overhead of scikit-learn's predict, while
+    giving the same labels.
+    """
+    KERNELS = ('rbf', 'linear')     # Supported kernels
+    FORMAT = 'blink-model'  # Format name stored in the artifact header
+    FORMAT_VERSION = 1  # Newest artifact version this code can read and the version it writes
+
+    def __init__(self, support_vectors, dual_coef, intercept, gamma, classes, kernel='rbf'):
+        if kernel not in BlinkModel.KERNELS:
+            raise ValueError("Unsupported blink model kernel: " + str(kernel))
+        self.kernel = kernel    # Kernel of the decision function
+        self.support_vectors = np.ascontiguousarray(support_vectors, dtype=np.float64)  # (S, F) support vectors
+        self.dual_coef = np.ascontiguousarray(dual_coef, dtype=np.float64).ravel()  # (S,) signed dual coefficients
+        self.intercept = float(intercept)   # Decision function offset
+        self.gamma = float(gamma)   # RBF kernel coefficient
+        self.classes = np.asarray(classes)  # Labels for negative and positive decision values
+        self._sv_norms = np.einsum('ij,ij->i', self.support_vectors, self.support_vectors)  # Squared norms
+        self._weights = self.dual_coef @ self.support_vectors   # Weight vector of a linear kernel
+
+    @property
+    def feature_size(self):
+        """
+        Number of eye aspect ratio values in a feature vector
+        """
+        return self.support_vectors.shape[1]
+
+    @staticmethod
+    def from_svc(svc):
+        """
+        Creates a blink model from a fitted scikit-learn SVC
+        :param svc:<SVC> A binary SVC fitted with an RBF kernel
+        """
+        if svc.kernel != 'rbf' or len(svc.classes_) != 2:
+            raise ValueError("Only binary SVCs with an RBF kernel can be exported")
+        return BlinkModel(svc.support_vectors_, svc.dual_coef_[0], svc.intercept_[0], svc._gamma, svc.classes_)
+
+    @staticmethod
+    def from_linear(estimator):
+        """
+        Creates a blink model from a fitted binary scikit-learn linear classifier, such as LinearSVC, an SVC with a
+        linear kernel or LogisticRegression
+        :param estimator:<object> A fitted classifier with coef_, intercept_ and classes_ attributes
+        """
+        if len(estimator.classes_) != 2:
+            raise ValueError("Only binary classifiers can be exported")
+        coef = np.asarray(estimator.coef_, dtype=np.float64).reshape(1, -1)
+        return BlinkModel(coef, [1.0], np.ravel(estimator.intercept_)[0], 0.0, estimator.classes_, kernel='linear')
+
+    @staticmethod
+    def from_estimator(estimator):
+        """
+        Creates a blink model from a fitted scikit-learn RBF SVC or linear classifier
+        :param estimator:<object> The fitted classifier
+        """
+        if getattr(estimator, 'kernel', 'linear') == 'rbf':
+            return BlinkModel.from_svc(estimator)
+        return BlinkModel.from_linear(estimator)
+
+    @staticmethod
+    def load(file_path):
+        """
+        Loads a blink model artifact saved with the save function. The artifact is an .npz file of plain NumPy arrays
+        with a JSON header, so loading needs neither pickle nor scikit-learn. Artifacts written before the header was
+        introduced are read as version 0.
+        :param file_path:<str> Path of the .npz model file
+        """
+        with np.load(file_path) as data:
+            header = json.loads(str(data['header'])) if 'header' in data else {'format': BlinkModel.FORMAT,
+                                                                               'version': 0, 'kernel': 'rbf'}
+            if header.get('format') != BlinkModel.FORMAT:
+                raise ValueError(file_path + " is not a blink model artifact")
+            if header['version'] > BlinkModel.FORMAT_VERSION:
+                raise ValueError(file_path + " uses blink model format version " + str(header['version']) +
+                                 ", this version reads up to " + str(BlinkModel.FORMAT_VERSION))
+            return BlinkModel(data['support_vectors'], data['dual_coef'], data['intercept'], data['gamma'],
+                              data['classes'], header['kernel'])
+
+    @staticmethod
+    def load_cached(file_path):
+        """
+        Loads a blink model artifact once per process and returns the same model on later calls, until the file changes
+        :param file_path:<str> Path of the .npz model file
+        """
+        stat = os.stat(file_path)
+        return _load_model(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    def save(self, file_path):
+        """
+        Saves the model as a versioned artifact: an uncompressed .npz file holding the parameter arrays and a JSON
+        header describing them
+        :param file_path:<str> Path of the .npz model file
+        """
+        header = {'format': BlinkModel.FORMAT, 'version': BlinkModel.FORMAT_VERSION, 'kernel': self.kernel,
+                  'feature_size': self.feature_size, 'support_vectors': len(self.dual_coef),
+                  'classes': [str(label) for label in self.classes],
+                  'created': time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+        np.savez(file_path, header=json.dumps(header), support_vectors=self.support_vectors,
+                 dual_coef=self.dual_coef, intercept=self.intercept, gamma=self.gamma, classes=self.classes)
+
+    def kernel_matrix(self, x):
+        """
+        Returns the (N, S) RBF kernel values between each feature vector and each support vector
+        :param x:<array> (N, F) array of feature vectors
+        """
+        x = np.asarray(x, dtype=np.float64)
+        # Squared euclidean distances expanded as |sv|^2 - 2 sv.x + |x|^2
+        sq_dist = self._sv_norms - 2.0 * (x @ self.support_vectors.T) + np.einsum('ij,ij->i', x, x)[:, np.newaxis]
+        np.maximum(sq_dist, 0.0, out=sq_dist)
+        return np.exp(-self.gamma * sq_dist, out=sq_dist)
+
+    def decision_function(self, x):
+        """
+        Returns the signed distance of each feature vector to the separating hyperplane. Positive values belong to the
+        second class.
+        :param x:<array> (N, F) array of feature vectors
+        """
+        if self.kernel == 'linear':
+            return np.asarray(x, dtype=np.float64) @ self._weights + self.intercept
+        return self.kernel_matrix(x) @ self.dual_coef + self.intercept
+
+    def predict(self, x):
+        """
+        Returns the predicted label for each feature vector
+        :param x:<array> (N, F) array of feature vectors
+        """
+        return self.classes[(self.decision_function(x) > 0).astype(np.intp)]
+
+
+@functools.lru_cache(maxsize=4)
+def _load_model(file_path, size, mtime_ns):
+    """
+    Loads a blink model, cached on the path, size and modification time of the file
+    """
+    return BlinkModel.load(file_path)
+
+
+def export_model(pickle_path, output_path):
+    """
+    Converts a pickled scikit-learn SVC into a blink model file. Returns the SVC and the exported blink model.
+    :param pickle_path:<str> Path of the pickled SVC
+    :param output_path:<str> Path of the .npz model file to be written
+    """
+    with open(pickle_path, 'rb') as f:
+        svc = pickle.load(f)
+    model = BlinkModel.from_svc(svc)
+    model.save(output_path)
+    return svc, model
+
+
+def check_parity(svc, model, ear_path, feature_size):
+    """
+    Classifies every feature window of an eye aspect ratio dataset with both the SVC and the blink model. Returns the
+    number of windows and the number of windows where the two predictions differ.
+    :param svc:<SVC> The fitted scikit-learn SVC
+    :param model:<BlinkModel> The blink model exported from the SVC
+    :param ear_path:<str> Path of a frame:ear text file
+    :param feature_size:<int> Number of eye aspect ratio values in a feature window
+    """
+    with open(ear_path, "r") as file:
+        windows = make_windows(parse_ear(file.readlines()), feature_size)
+    mismatches = np.count_nonzero(svc.predict(windows) != model.predict(windows))
+    return len(windows), mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a pickled blink SVM to a NumPy blink model")
+    parser.add_argument("--pickle", default="resources/blink_model.pk1", help="pickled scikit-learn SVC")
+    parser.add_argument("--output", default="resources/blink_model.npz", help="blink model file to write")
+    parser.add_argument("--ear", default="resources/datasets/ear_output_eyeblink8.txt",
+                        help="eye aspect ratio dataset used to check that both models agree")
+    args = parser.parse_args()
+    exported_svc, exported_model = export_model(args.pickle, args.output)
+    total, differ = check_parity(exported_svc, exported_model, args.ear, exported_model.support_vectors.shape[1])
+    print("Exported " + str(len(exported_model.dual_coef)) + " support vectors to " + args.output)
+    print("Parity check: " + str(differ) + " of " + str(total) + " predictions differ")
+    if differ:
+        raise SystemExit(1)
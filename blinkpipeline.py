@@ -0,0 +1,196 @@
+import queue
+import threading
+import time
+import traceback
+
+
+class BlinkPipeline:
+    """
+    The BlinkPipeline class moves frame capture and blink inference off the Qt GUI thread. A capture thread reads
+    frames from the blink detector's video source into a bounded queue, and an inference thread feeds the queued frames
+    to the blink detector. When inference falls behind, the stale frame waiting in the queue is dropped in favour of the
+    newest one, so the delay between a blink and its detection stays bounded. An optional frame rate governor chooses
+    which captured frames are processed, and the rest are skipped before they reach the queue. The blink detector's
+    signals are emitted from the inference thread and reach the GUI through queued connections. An exception in either
+    thread stops both, which releases the video source, and is passed to the error callback.
+    """
+    QUEUE_SIZE = 1      # Number of frames that can wait for inference
+    QUEUE_TIMEOUT = 0.1     # Seconds the inference thread waits for a frame before checking if it should stop
+
+    def __init__(self, blink_detector, governor=None, error_callback=None):
+        self.blink_detector = blink_detector   # Blink detector that reads and processes the frames
+        self.governor = governor    # FrameRateGovernor choosing the frames to process, None to process every frame
+        self.error_callback = error_callback    # Called from a worker thread with the exception that stopped it
+        self.skipped_frames = 0     # Number of frames the governor skipped
+        self.dropped_frames = 0     # Number of stale frames dropped because inference fell behind
+        self._frames = queue.Queue(maxsize=BlinkPipeline.QUEUE_SIZE)  # Frames waiting for inference
+        self._running = threading.Event()   # Set while the worker threads should keep running
+        self._paused = threading.Event()    # Set while captured frames should be discarded
+        self._capture_thread = None
+        self._inference_thread = None
+
+    def start(self):
+        """
+        Starts the capture and inference threads
+        """
+        if self._running.is_set():
+            return
+        self._running.set()
+        self._paused.clear()
+        if self.governor is not None:
+            self.governor.reset(time.perf_counter())
+        self._capture_thread = threading.Thread(target=self._capture_loop, name="BlinkCapture", daemon=True)
+        self._inference_thread = threading.Thread(target=self._inference_loop, name="BlinkInference", daemon=True)
+        self._capture_thread.start()
+        self._inference_thread.start()
+
+    def stop(self):
+        """
+        Stops the capture and inference threads and waits for them to finish
+        """
+        self._running.clear()
+        for thread in (self._capture_thread, self._inference_thread):
+            if thread is not None:
+                thread.join()
+        self._capture_thread = None
+        self._inference_thread = None
+        self._clear_frames()
+
+    def pause(self):
+        """
+        Discards captured frames until resume is called. Capture keeps running so the video source does not buffer
+        frames that would be stale when inference resumes.
+        """
+        self._paused.set()
+        self._clear_frames()
+
+    def resume(self):
+        """
+        Resumes inference on newly captured frames
+        """
+        self._paused.clear()
+
+    def is_running(self):
+        """
+        Returns true while the worker threads are running
+        """
+        return self._running.is_set()
+
+    def _put_frame(self, frame):
+        """
+        Queues a frame for inference, replacing the oldest queued frame if the queue is full. A replaced frame and the
+        frames skipped before it are added to the new frame's skipped count, so the blink detector still accounts for
+        every video frame.
+        :param frame:<tuple> (frame, latency monitor row, frames skipped before it, capture time) to be queued
+        """
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    stale = self._frames.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped_frames += 1
+                self._discard_latency(stale[1])
+                frame = frame[:2] + (frame[2] + stale[2] + 1,) + frame[3:]
+
+    def _discard_latency(self, row):
+        """
+        Removes a frame that will not be processed from the latency monitor
+        :param row:<int> Latency monitor row of the frame, None if the frame is not being timed
+        """
+        if row is not None:
+            self.blink_detector.latency.discard(row)
+
+    def _finish_frames(self):
+        """
+        Tells the inference thread to finish once it has processed the frames still queued. Waits for room in the queue
+        rather than replacing a queued frame, so the last frames of a source are not lost.
+        """
+        while self._running.is_set():
+            try:
+                self._frames.put(None, timeout=BlinkPipeline.QUEUE_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def _clear_frames(self):
+        """
+        Removes every frame waiting in the queue
+        """
+        while True:
+            try:
+                frame = self._frames.get_nowait()
+            except queue.Empty:
+                return
+            if frame is not None:
+                self._discard_latency(frame[1])
+
+    def _fail(self, error):
+        """
+        Stops both worker threads after an exception in one of them and reports it
+        :param error:<Exception> The exception
+        """
+        traceback.print_exc()
+        self._running.clear()
+        if self.error_callback is not None:
+            self.error_callback(error)
+
+    def _capture_loop(self):
+        """
+        Opens the video source, reads frames until stopped or the source runs out of frames, then releases the source
+        """
+        try:
+            self.blink_detector.open()
+            skipped = 0     # Frames skipped by the governor since the last queued frame
+            while self._running.is_set():
+                # Frames are only decoded once it is known they will be processed
+                if not self.blink_detector.grab_frame():
+                    break
+                if self._paused.is_set():
+                    continue
+                timestamp = time.perf_counter()
+                if self.governor is not None and not self.governor.due(timestamp):
+                    skipped += 1
+                    self.skipped_frames += 1
+                    continue
+                latency = self.blink_detector.latency
+                row = latency.begin() if latency is not None else None
+                success, frame = self.blink_detector.retrieve_frame()
+                if not success:
+                    self._discard_latency(row)
+                    continue    # A frame that could not be decoded is dropped, the next grab ends the source
+                self.blink_detector.mark_latency(row, 'capture')
+                self._put_frame((frame, row, skipped, timestamp))
+                skipped = 0
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self.blink_detector.close()
+            self._finish_frames()
+
+    def _inference_loop(self):
+        """
+        Runs blink detection on queued frames until stopped or the capture thread finishes
+        """
+        try:
+            while self._running.is_set():
+                try:
+                    frame = self._frames.get(timeout=BlinkPipeline.QUEUE_TIMEOUT)
+                except queue.Empty:
+                    continue
+                if frame is None:
+                    break
+                frame, row, skipped, timestamp = frame
+                if self._paused.is_set():
+                    self._discard_latency(row)
+                    continue
+                self.blink_detector.skip_frames(skipped)
+                self.blink_detector.process_frame(frame, row)
+                if self.governor is not None:
+                    self.governor.update(self.blink_detector.face_found, self.blink_detector.last_ear, timestamp)
+        except Exception as error:
+            self._fail(error)
+        self._running.clear()
@@ -0,0 +1,93 @@
+from PySide2.QtCore import QObject, Qt, Signal
+from blinkdetector import BlinkDetector, load_face_models
+from blinkmodel import BlinkModel
+from blinkpipeline import BlinkPipeline
+from governor import FrameRateGovernor
+from latency import LatencyMonitor
+
+
+class BlinkService(QObject):
+    """
+    The BlinkService class is the long-lived owner of the blink detector and its pipeline. The main window preloads the
+    models on a background thread at startup and creates the service when the blink controller is first started.
+    A blink controller session attaches to the service to start capture and detaches to stop it, which releases the
+    camera, while the loaded models, blink detector and pipeline stay in memory for the next session. An exception that
+    stops capture or inference, such as a missing model file, is reported to the attached session through error.
+    """
+    error = Signal(str)     # Description of the exception that stopped blink detection
+
+    def __init__(self, file_path=0, target_fps=FrameRateGovernor.TARGET_FPS):
+        super(BlinkService, self).__init__()
+        self.blink_detector = BlinkDetector(file_path, False, lazy=True)     # Shared by every session
+        self.governor = FrameRateGovernor(target_fps)   # Lowers the processing rate while the user is idle
+        self.blink_pipeline = BlinkPipeline(self.blink_detector, self.governor, self.report_error)
+        self.latency = LatencyMonitor()     # Stage latencies of the most recent frames, across sessions
+        self.blink_detector.latency = self.latency
+        self._slots = None  # (face detected slot, blink detected slot, error slot) of the attached session
+
+    @staticmethod
+    def load_models():
+        """
+        Fills the per-process model caches used by the blink detector. Called on a background thread at startup.
+        """
+        BlinkModel.load_cached(BlinkDetector.MODEL_PATH)
+        load_face_models()
+
+    def report_error(self, error):
+        """
+        Emits error for an exception that stopped blink detection. Called from the pipeline's worker threads.
+        :param error:<Exception> The exception
+        """
+        self.error.emit(type(error).__name__ + ": " + str(error))
+
+    def attach(self, face_detected_slot, blink_detected_slot, error_slot=None):
+        """
+        Connects a session to the blink detector's signals and starts capture. The camera is opened, and any model still
+        loading is awaited, on the capture thread, so this returns immediately.
+        :param face_detected_slot:<function> Called on the GUI thread with true or false as the face is found or lost
+        :param blink_detected_slot:<function> Called on the GUI thread when a blink is detected
+        :param error_slot:<function> Called on the GUI thread with a description of the error if blink detection stops
+        """
+        if self._slots is not None:
+            self.detach()
+        self._slots = (face_detected_slot, blink_detected_slot, error_slot)
+        # The blink detector runs on the pipeline's worker threads, so its signals are queued to the GUI thread
+        self.blink_detector.face_detected.connect(face_detected_slot, Qt.QueuedConnection)
+        self.blink_detector.blink_detected.connect(blink_detected_slot, Qt.QueuedConnection)
+        if error_slot is not None:
+            self.error.connect(error_slot, Qt.QueuedConnection)
+        self.blink_detector.reset()
+        self.blink_pipeline.start()
+        return self.blink_detector
+
+    def detach(self):
+        """
+        Stops capture, releases the camera and disconnects the attached session
+        """
+        self.blink_pipeline.stop()
+        if self._slots is not None:
+            face_detected_slot, blink_detected_slot, error_slot = self._slots
+            self.blink_detector.face_detected.disconnect(face_detected_slot)
+            self.blink_detector.blink_detected.disconnect(blink_detected_slot)
+            if error_slot is not None:
+                self.error.disconnect(error_slot)
+            self._slots = None
+
+    def mark_blink_shown(self):
+        """
+        Records that the GUI has repainted its feedback for the last detected blink, completing that frame's latency
+        """
+        row, self.blink_detector.blink_latency_row = self.blink_detector.blink_latency_row, None
+        self.blink_detector.mark_latency(row, 'repaint')
+
+    def pause(self):
+        """
+        Discards frames while blink feedback is shown
+        """
+        self.blink_pipeline.pause()
+
+    def resume(self):
+        """
+        Resumes blink detection after blink feedback
+        """
+        self.blink_pipeline.resume()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from scipy.stats import loguniform
+from sklearn import svm
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import classification_report, f1_score, make_scorer
+from sklearn.model_selection import GridSearchCV, GroupKFold, RandomizedSearchCV, cross_val_predict
+import blinkdataset
+from blinkmodel import BlinkModel
+
+WINDOW_SIZES = (9, 13, 17)  # Candidate numbers of eye aspect ratio values per feature vector
+C_VALUES = (0.1, 1, 10, 100)    # Candidate regularization strengths
+GAMMA_VALUES = ('scale', 1, 10, 30, 100)    # Candidate RBF kernel coefficients
+CLASS_WEIGHTS = (None, 'balanced', {'C': 0.7, 'X': 0.3})   # Candidate class weightings
+CV_FOLDS = 5    # Maximum number of cross-validation folds, each holding out whole videos
+LATENCY_REPEATS = 2000  # Number of single-vector predictions timed when measuring latency
+REDUCE_SAMPLES = 5000   # Maximum number of training windows used to refit a reduced support vector set
+
+
+def make_search(kernel, n_iter, n_splits, workers):
+    """
+    Creates the hyperparameter search for one window size. Searches every combination of C, gamma and class weight, or
+    n_iter random combinations when n_iter is positive. Candidates are scored by the F1 score of the blink class.
+    :param kernel:<str> 'rbf' for an RBF SVC or 'linear' for a LinearSVC
+    :param n_iter:<int> Number of random combinations, 0 for a full grid search
+    :param n_splits:<int> Number of grouped cross-validation folds
+    :param workers:<int> Number of parallel joblib workers, -1 for all cores
+    """
+    if kernel == 'linear':
+        estimator = svm.LinearSVC(dual=False, max_iter=10000)
+        grid = {'C': list(C_VALUES), 'class_weight': list(CLASS_WEIGHTS)}
+        distributions = {'C': loguniform(1e-2, 1e3), 'class_weight': list(CLASS_WEIGHTS)}
+    else:
+        estimator = svm.SVC(kernel='rbf')
+        grid = {'C': list(C_VALUES), 'gamma': list(GAMMA_VALUES), 'class_weight': list(CLASS_WEIGHTS)}
+        distributions = {'C': loguniform(1e-2, 1e3), 'gamma': loguniform(1e-1, 1e3),
+                         'class_weight': list(CLASS_WEIGHTS)}
+    scorer = make_scorer(f1_score, pos_label='C')
+    cv = GroupKFold(n_splits=n_splits)
+    if n_iter > 0:
+        return RandomizedSearchCV(estimator, distributions, n_iter=n_iter, scoring=scorer, cv=cv, n_jobs=workers,
+                                  random_state=0)
+    return GridSearchCV(estimator, grid, scoring=scorer, cv=cv, n_jobs=workers)
+
+
+def train(ear_paths, label_paths, window_sizes=WINDOW_SIZES, kernel='rbf', n_iter=0, workers=-1):
+    """
+    Searches hyperparameters for every window size with cross-validation grouped by source video, so no video appears
+    in both the training and validation folds. Returns the best estimator refitted on all data, its window size and a
+    dictionary of metrics.
+    :param ear_paths:<list> Paths of frame:ear text files
+    :param label_paths:<list> Paths of the matching label text files
+    :param window_sizes:<list> Candidate numbers of eye aspect ratio values per feature vector, all odd
+    :param kernel:<str> 'rbf' for an RBF SVC or 'linear' for a LinearSVC
+    :param n_iter:<int> Number of random combinations per window size, 0 for a full grid search
+    :param workers:<int> Number of parallel joblib workers, -1 for all cores
+    """
+    best = None
+    results = []
+    for size in window_sizes:
+        if size % 2 == 0:
+            raise ValueError("Window sizes must be odd so every window is centred on a frame")
+        x, y, groups = blinkdataset.load_grouped_data(ear_paths, label_paths, size)
+        n_splits = min(CV_FOLDS, len(np.unique(groups)))
+        search = make_search(kernel, n_iter, n_splits, workers)
+        start = time.perf_counter()
+        search.fit(x, y, groups=groups)
+        elapsed = time.perf_counter() - start
+        params = {key: value for key, value in search.best_params_.items()}
+        results.append({'window_size': size, 'cv_f1': search.best_score_, 'params': params,
+                        'search_seconds': elapsed})
+        print("window " + str(size) + ": cv f1 " + str(round(search.best_score_, 4)) + " with " + str(params) +
+              " (" + str(round(elapsed, 1)) + " s)", flush=True)
+        if best is None or search.best_score_ > best[0].best_score_:
+            best = (search, size, x, y, groups, n_splits)
+    search, size, x, y, groups, n_splits = best
+    # Out-of-fold predictions of the best configuration give an unbiased report
+    y_pred = cross_val_predict(search.best_estimator_, x, y, groups=groups, cv=GroupKFold(n_splits=n_splits),
+                               n_jobs=workers)
+    report = classification_report(y, y_pred, output_dict=True, zero_division=0)
+    print(classification_report(y, y_pred, zero_division=0))
+    model = search.best_estimator_
+    metrics = {'kernel': kernel, 'window_size': size, 'cv_f1': search.best_score_, 'params': search.best_params_,
+               'support_vectors': int(len(model.support_vectors_)) if kernel == 'rbf' else 0,
+               'report': report, 'search': results}
+    return model, size, metrics
+
+
+def measure_latency(model, x, repeats=LATENCY_REPEATS):
+    """
+    Returns the median time in microseconds the blink model takes to classify a single feature vector, the way the blink
+    detector calls it on every frame
+    :param model:<BlinkModel> The blink model
+    :param x:<array> Feature vectors to cycle through
+    :param repeats:<int> Number of timed predictions
+    """
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        vector = x[i % len(x)][np.newaxis]
+        start = time.perf_counter()
+        model.predict(vector)
+        timings[i] = time.perf_counter() - start
+    return float(np.median(timings) * 1e6)
+
+
+def reduce_svm(model, x, n_vectors):
+    """
+    Creates a reduced-set RBF model that keeps the n_vectors support vectors with the largest dual coefficients. New
+    coefficients and intercept are fitted by least squares so the reduced decision function follows the full one on
+    the training windows.
+    :param model:<BlinkModel> The full RBF blink model
+    :param x:<array> Training feature vectors
+    :param n_vectors:<int> Number of support vectors to keep
+    """
+    if model.kernel != 'rbf':
+        raise ValueError("Only RBF models have support vectors to reduce")
+    keep = np.sort(np.argsort(-np.abs(model.dual_coef))[:n_vectors])
+    rng = np.random.default_rng(0)
+    sample = x[rng.choice(len(x), min(len(x), REDUCE_SAMPLES), replace=False)]
+    target = model.decision_function(sample)
+    basis = BlinkModel(model.support_vectors[keep], np.zeros(len(keep)), 0.0, model.gamma, model.classes)
+    # Kernel matrix between the sample and the kept support vectors, plus a column of ones for the intercept
+    kernel = np.hstack((basis.kernel_matrix(sample), np.ones((len(sample), 1))))
+    solution = np.linalg.lstsq(kernel, target, rcond=None)[0]
+    return BlinkModel(basis.support_vectors, solution[:-1], solution[-1], model.gamma, model.classes)
+
+
+def distill_logistic(model, x):
+    """
+    Distills a blink model into a logistic regression over the same feature vectors, trained on the labels the original
+    model predicts for the training windows
+    :param model:<BlinkModel> The blink model to imitate
+    :param x:<array> Training feature vectors
+    """
+    student = LogisticRegression(max_iter=1000)
+    student.fit(x, model.predict(x))
+    return BlinkModel.from_linear(student)
+
+
+def describe(model, x, y, teacher=None):
+    """
+    Returns the size, latency and accuracy metrics of a blink model
+    :param model:<BlinkModel> The blink model
+    :param x:<array> Feature vectors
+    :param y:<array> True labels of the feature vectors
+    :param teacher:<BlinkModel> Model the blink model was derived from, used to measure their agreement
+    """
+    y_pred = model.predict(x)
+    info = {'kernel': model.kernel, 'support_vectors': len(model.dual_coef) if model.kernel == 'rbf' else 0,
+            'latency_us': measure_latency(model, x), 'f1': f1_score(y, y_pred, pos_label='C', zero_division=0)}
+    if teacher is not None:
+        info['teacher_agreement'] = float(np.mean(y_pred == teacher.predict(x)))
+    return info
+
+
+def save(model, metrics, model_path, metrics_path):
+    """
+    Saves the trained model as a blink model file and its metrics as JSON
+    :param model:<BlinkModel> The blink model
+    :param metrics:<dict> Metrics returned by train
+    :param model_path:<str> Path of the .npz blink model file
+    :param metrics_path:<str> Path of the metrics JSON file
+    """
+    model.save(model_path)
+    with open(metrics_path, "w") as file:
+        json.dump(metrics, file, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search hyperparameters and train the blink classifier")
+    parser.add_argument("--ear", nargs="+", default=[blinkdataset.EAR_PATH], help="frame:ear text files")
+    parser.add_argument("--labels", nargs="+", default=[blinkdataset.LABEL_PATH], help="matching label text files")
+    parser.add_argument("--window-sizes", nargs="+", type=int, default=list(WINDOW_SIZES),
+                        help="odd numbers of eye aspect ratio values per feature vector")
+    parser.add_argument("--kernel", choices=("rbf", "linear"), default="rbf",
+                        help="rbf SVC, or linear SVM whose prediction cost does not grow with the training set")
+    parser.add_argument("--random", type=int, default=0, metavar="N",
+                        help="try N random hyperparameter combinations per window size instead of the full grid")
+    parser.add_argument("--reduce", type=int, default=0, metavar="N",
+                        help="keep only N support vectors of an rbf model, refitting their coefficients")
+    parser.add_argument("--distill", choices=("logistic",), help="distill the model into a smaller classifier")
+    parser.add_argument("--budget-us", type=float, default=0,
+                        help="reject the model if a single prediction takes longer than this many microseconds")
+    parser.add_argument("-j", "--workers", type=int, default=-1, help="parallel workers, -1 for all cores")
+    parser.add_argument("--output", default="resources/blink_model.npz", help="blink model file to write")
+    parser.add_argument("--metrics", default="resources/blink_model_metrics.json", help="metrics JSON file to write")
+    args = parser.parse_args()
+    if len(args.ear) != len(args.labels):
+        parser.error("--ear and --labels must list the same number of files")
+    trained_model, window_size, trained_metrics = train(args.ear, args.labels, args.window_sizes, args.kernel,
+                                                        args.random, args.workers)
+    x_all, y_all, _ = blinkdataset.load_grouped_data(args.ear, args.labels, window_size)
+    full_model = BlinkModel.from_estimator(trained_model)
+    blink_model = full_model
+    trained_metrics['trained'] = describe(full_model, x_all, y_all)
+    if args.reduce:
+        blink_model = reduce_svm(blink_model, x_all, args.reduce)
+    if args.distill == 'logistic':
+        blink_model = distill_logistic(blink_model, x_all)
+    if blink_model is not full_model:
+        trained_metrics['compressed'] = describe(blink_model, x_all, y_all, full_model)
+    final = trained_metrics.get('compressed', trained_metrics['trained'])
+    print("Final model: " + str(final['support_vectors']) + " support vectors, " +
+          str(round(final['latency_us'], 1)) + " us per prediction, f1 " + str(round(final['f1'], 4)))
+    if args.budget_us and final['latency_us'] > args.budget_us:
+        raise SystemExit("Rejected: " + str(round(final['latency_us'], 1)) + " us per prediction exceeds the budget of "
+                         + str(args.budget_us) + " us")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    save(blink_model, trained_metrics, args.output, args.metrics)
+    print("Saved model to " + args.output + " and metrics to " + args.metrics)
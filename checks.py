@@ -0,0 +1,214 @@
+import argparse
+import collections
+import os
+import tempfile
+import cv2
+import dlib
+import numpy as np
+import extract_ear
+from blinkdetector import BlinkDetector
+from blinkmodel import BlinkModel
+from earbuffer import EarBuffer
+from governor import FrameRateGovernor
+
+FACE_BRIGHTNESS = 16    # Minimum mean brightness of a frame in which the stub face detector finds a face
+CHECK_SHAPE = (64, 64, 3)   # Shape of the frames generated for the checks
+LandmarkPoint = collections.namedtuple('LandmarkPoint', ['x', 'y'])
+
+
+class StubLandmarks:
+    """
+    Stands in for dlib's full_object_detection, holding the points found by stub_landmarks
+    """
+
+    def __init__(self, points):
+        self._points = [LandmarkPoint(x, y) for x, y in points.tolist()]
+
+    def parts(self):
+        return self._points
+
+
+def stub_face_detector(gray_small, upsample):
+    """
+    Stands in for dlib's face detector. A frame shows a face when its mean brightness is at least FACE_BRIGHTNESS, and
+    the face box moves with the brightness, so a face box found in an earlier frame gives different landmarks.
+    :param gray_small:<array> The downsized grayscale frame
+    :param upsample:<int> Number of times the frame is up-sampled, ignored
+    """
+    brightness = int(gray_small.mean())
+    if brightness < FACE_BRIGHTNESS:
+        return []
+    height, width = gray_small.shape[:2]
+    offset = brightness % 4
+    return [dlib.rectangle(offset, offset, width // 2 + offset, height // 2 + offset)]
+
+
+def stub_landmarks(gray, face):
+    """
+    Stands in for dlib's landmark predictor. Places both eyes in the face box, opened by an amount that depends on the
+    box and the frame's brightness.
+    :param gray:<array> The grayscale frame
+    :param face:<rectangle> The face box in frame coordinates
+    """
+    points = np.zeros((68, 2))
+    opening = 1 + face.left() % 5 + gray.mean() / 64
+    eye = np.array([(0, 0), (2, -opening), (6, -opening), (8, 0), (6, opening), (2, opening)])
+    points[BlinkDetector.LEFT_EYE_OFFSET:BlinkDetector.LEFT_EYE_OFFSET + 6] = eye + (face.left(), face.top())
+    points[BlinkDetector.RIGHT_EYE_OFFSET:BlinkDetector.RIGHT_EYE_OFFSET + 6] = eye + (face.left() + 12, face.top())
+    return StubLandmarks(points)
+
+
+class StubBlinkDetector(BlinkDetector):
+    """
+    A blink detector that uses the blink model but replaces the face detector and landmark predictor with stubs, so
+    the detection schedule can be checked without a camera or the landmark model
+    """
+
+    def load_models(self):
+        self._blink_model = BlinkModel.load_cached(BlinkDetector.MODEL_PATH)
+        self._ear_feature = EarBuffer(self._blink_model.feature_size)
+        self._face_detector = stub_face_detector
+        self._landmark_detector = stub_landmarks
+
+
+def check_governor(seconds=4.0, fps=30):
+    """
+    Drives the blink detector through the frame rate governor the way BlinkPipeline does, with a face that is visible
+    for the first half of the frames. For every phase of the first processed frame, checks that the face detector
+    still runs every SKIP_FRAMES processed frames while the governor skips frames, and that the face is reported lost
+    within SKIP_FRAMES processed frames of leaving. Returns a list of failures.
+    :param seconds:<float> Length of the simulated capture
+    :param fps:<float> Capture frame rate
+    """
+    failures = []
+    count = int(seconds * fps)
+    face_frames = count // 2
+    face = np.full(CHECK_SHAPE, 128, dtype=np.uint8)
+    no_face = np.zeros(CHECK_SHAPE, dtype=np.uint8)
+    for phase in range(BlinkDetector.SKIP_FRAMES):
+        detector = StubBlinkDetector(None, False, roi_mode=False)
+        detector.skip_frames(phase)
+        governor = FrameRateGovernor()
+        governor.reset()
+        skipped = processed = face_processed = face_runs = 0
+        lost_after = None   # Processed frames between the face leaving and the detector reporting it lost
+        for i in range(count):
+            timestamp = i / fps
+            if not governor.due(timestamp):
+                skipped += 1
+                continue
+            detector.skip_frames(skipped)
+            skipped = 0
+            detector.process_frame(face if i < face_frames else no_face)
+            governor.update(detector.face_found, detector.last_ear, timestamp)
+            processed += 1
+            if i < face_frames:
+                face_processed, face_runs = processed, detector.detector_runs
+            elif lost_after is None and not detector.face_found:
+                lost_after = processed - face_processed
+        print("governor, phase " + str(phase) + ": " + str(processed) + " of " + str(count) + " frames processed, " +
+              str(face_runs) + " face detector runs in " + str(face_processed) + " frames with a face, face lost " +
+              "after " + str(lost_after) + " processed frames")
+        if face_runs < face_processed // BlinkDetector.SKIP_FRAMES:
+            failures.append("governor, phase " + str(phase) + ": the face detector stopped running")
+        if lost_after is None or lost_after > BlinkDetector.SKIP_FRAMES:
+            failures.append("governor, phase " + str(phase) + ": the face was not reported lost")
+    return failures
+
+
+def write_check_video(path, count, fps=30):
+    """
+    Writes a short video of plain frames with a random brightness per frame, and every fifth run of 17 frames dark so
+    the stub face detector loses the face
+    :param path:<str> Path of the .avi file
+    :param count:<int> Number of frames
+    :param fps:<float> Frame rate stored in the video
+    """
+    rng = np.random.RandomState(0)
+    height, width = CHECK_SHAPE[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for i in range(count):
+        brightness = 0 if (i // 17) % 5 == 4 else rng.randint(40, 220)
+        writer.write(np.full(CHECK_SHAPE, brightness, dtype=np.uint8))
+    writer.release()
+
+
+def check_extraction(count=300, chunk_frames=45):
+    """
+    Extracts the eye aspect ratios of a generated video serially and in frame-range chunks with a stub blink detector,
+    the way extract_ear.py does on its worker processes, and checks that both outputs are identical. The stub face box
+    moves every frame, so a chunk whose SKIP_FRAMES schedule differs from the serial run gives different values.
+    Chunks are extracted in reverse order to catch state carried from one chunk to the next. Returns a list of
+    failures.
+    :param count:<int> Number of frames in the video
+    :param chunk_frames:<int> Number of frames per chunk
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "check.avi")
+        write_check_video(path, count)
+        extract_ear._blink_detector = StubBlinkDetector(None, False, tracking_mode=False, roi_mode=False)
+        serial = extract_ear.extract_range((path, 0, None))[2]
+        ranges = extract_ear.split_frames(extract_ear.count_frames(path), chunk_frames)
+        parts = [extract_ear.extract_range((path, start, end))[1:3] for start, end in reversed(ranges)]
+        chunked = np.concatenate([ear for _, ear in sorted(parts, key=lambda part: part[0])])
+    differ = np.count_nonzero(serial != chunked) if len(serial) == len(chunked) else len(serial)
+    print("extraction: " + str(len(serial)) + " frames serially, " + str(len(chunked)) + " frames in " +
+          str(len(ranges)) + " chunks, " + str(differ) + " values differ")
+    if len(serial) != count or differ:
+        return ["extraction: chunked output does not match serial extraction"]
+    return []
+
+
+def check_model(count=2000, feature_size=BlinkDetector.EAR_FEATURE_SIZE):
+    """
+    Fits scikit-learn RBF and linear classifiers on generated eye aspect ratio windows, exports them as blink models,
+    saves and reloads them, and checks that the blink models give the same labels and decision values on windows they
+    were not fitted on. Returns a list of failures.
+    :param count:<int> Number of generated windows, half used for fitting
+    :param feature_size:<int> Number of eye aspect ratio values in a window
+    """
+    # scikit-learn is only needed for training, like in BlinkDetector.train_svm
+    from sklearn import svm
+    rng = np.random.RandomState(0)
+    windows = rng.normal(0.3, 0.03, (count, feature_size))
+    labels = np.where(rng.rand(count) < 0.3, 'C', 'O')
+    # Blinks dip in the middle of the window
+    dip = np.exp(-0.5 * ((np.arange(feature_size) - feature_size // 2) / 2.0) ** 2)
+    windows[labels == 'C'] -= 0.15 * dip
+    fit, test = slice(0, count // 2), slice(count // 2, count)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, estimator in (("rbf", svm.SVC(kernel='rbf', C=1, gamma='scale')), ("linear", svm.LinearSVC())):
+            estimator.fit(windows[fit], labels[fit])
+            path = os.path.join(directory, name + ".npz")
+            BlinkModel.from_estimator(estimator).save(path)
+            model = BlinkModel.load(path)
+            differ = np.count_nonzero(estimator.predict(windows[test]) != model.predict(windows[test]))
+            error = np.abs(estimator.decision_function(windows[test]) - model.decision_function(windows[test])).max()
+            print("model, " + name + ": " + str(differ) + " of " + str(count - count // 2) + " labels differ, " +
+                  "largest decision value difference " + str(error))
+            if differ or error > 1e-9:
+                failures.append("model, " + name + ": the blink model does not match scikit-learn")
+    return failures
+
+
+CHECKS = {'governor': check_governor, 'extraction': check_extraction, 'model': check_model}  # Checks run by name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Self-contained correctness checks of the blink detection pipeline")
+    parser.add_argument("checks", nargs="*", metavar="check", help="checks to run, all by default: " +
+                        ", ".join(sorted(CHECKS)))
+    args = parser.parse_args()
+    names = args.checks or sorted(CHECKS)
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        parser.error("unknown checks: " + ", ".join(unknown))
+    failed = []
+    for name in names:
+        failed += CHECKS[name]()
+    for failure in failed:
+        print("FAILED " + failure)
+    print(str(len(names)) + " checks run, " + str(len(failed)) + " failures")
+    if failed:
+        raise SystemExit(1)
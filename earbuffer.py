@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class EarBuffer:
+    """
+    The EarBuffer class is a fixed size ring buffer holding the most recent eye aspect ratio values, newest first. Every
+    value is written twice into a preallocated array of double length, so the buffered values can always be read as a
+    single ordered view of the array without shifting or copying any elements.
+    """
+
+    def __init__(self, size):
+        self.size = size    # Maximum number of values held by the buffer
+        self._data = np.zeros(2 * size, dtype=np.float64)  # Values stored twice so that any window is contiguous
+        self._head = 0  # Index of the newest value in the first half of the array
+        self._count = 0     # Number of values currently held
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        """
+        Returns the value at the specified age, where 0 is the newest value
+        :param index:<int> Age of the value
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("EarBuffer index out of range")
+        return self._data[self._head + index]
+
+    def push(self, value):
+        """
+        Adds a value as the newest entry, discarding the oldest entry if the buffer is full
+        :param value:<float> The eye aspect ratio value to be added
+        """
+        self._head = (self._head - 1) % self.size
+        self._data[self._head] = value
+        self._data[self._head + self.size] = value
+        if self._count < self.size:
+            self._count += 1
+
+    def view(self):
+        """
+        Returns a read-only view of the buffered values ordered from newest to oldest. The view shares memory with the
+        buffer, so it reflects later pushes and must be copied if it needs to be kept.
+        """
+        window = self._data[self._head:self._head + self._count]
+        window.flags.writeable = False
+        return window
+
+    def clear(self):
+        """
+        Removes all values from the buffer
+        """
+        self._head = 0
+        self._count = 0
@@ -0,0 +1,197 @@
+import argparse
+import multiprocessing
+import os
+import time
+import cv2
+import numpy as np
+from blinkdetector import BlinkDetector
+
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mkv", ".wmv")     # File types picked up when a directory is given
+CHUNK_SIZE = 4096   # Number of eye aspect ratio values held per preallocated chunk
+CHUNK_FRAMES = 3000     # Default number of frames per parallel chunk of a single video
+WARMUP_FRAMES = BlinkDetector.SKIP_FRAMES   # Frames processed before a chunk so the face detector state matches
+
+_blink_detector = None  # Blink detector owned by the current worker process
+
+
+def init_worker():
+    """
+    Loads the face detector, landmark predictor and blink model once per worker process
+    """
+    global _blink_detector
+    # Full-frame SKIP_FRAMES detection keeps the output independent of how the video is scheduled
+    _blink_detector = BlinkDetector(None, False, tracking_mode=False, roi_mode=False)
+
+
+def find_videos(paths, output_dir):
+    """
+    Returns a list of (video path, output path) pairs for the given video files and directories. Videos found inside a
+    directory keep their relative location under the output directory.
+    :param paths:<list> Video files and directories holding video files
+    :param output_dir:<str> Directory the .npy outputs are written to
+    """
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        relative = os.path.relpath(os.path.join(root, name), path)
+                        tasks.append((os.path.join(root, name),
+                                      os.path.join(output_dir, os.path.splitext(relative)[0] + ".npy")))
+        else:
+            name = os.path.splitext(os.path.basename(path))[0]
+            tasks.append((path, os.path.join(output_dir, name + ".npy")))
+    return tasks
+
+
+def count_frames(video_path):
+    """
+    Returns the number of frames reported by the video container
+    :param video_path:<str> Path of the video file
+    """
+    cap = cv2.VideoCapture(video_path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return count
+
+
+def split_frames(frame_count, chunk_frames):
+    """
+    Splits a video into [start, end) frame ranges of chunk_frames frames. The last range has no end and runs until the
+    video has no more frames, since the reported frame count of some containers is inaccurate.
+    :param frame_count:<int> Number of frames reported for the video
+    :param chunk_frames:<int> Number of frames per range, 0 to process the video as one range
+    """
+    if chunk_frames <= 0 or frame_count <= chunk_frames:
+        return [(0, None)]
+    starts = list(range(0, frame_count, chunk_frames))
+    if frame_count - starts[-1] < chunk_frames // 2:
+        starts.pop()    # Fold a short tail into the previous range
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def open_at(video_path, frame):
+    """
+    Opens a video positioned at the specified frame. Falls back to reading from the start if the backend cannot seek
+    to the exact frame.
+    :param video_path:<str> Path of the video file
+    :param frame:<int> Index of the next frame to be read
+    """
+    cap = cv2.VideoCapture(video_path)
+    if frame == 0:
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame:
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+        for _ in range(frame):
+            if not cap.grab():
+                break
+    return cap
+
+
+def extract_range(task):
+    """
+    Calculates the eye aspect ratio of every frame in a frame range of a video. Processing starts WARMUP_FRAMES early so
+    the detector state, and therefore the output, matches a serial run over the whole video. Returns the video path,
+    range start, float32 eye aspect ratio array, processing time and worker process id.
+    :param task:<tuple> (video path, start frame, end frame or None) triple
+    """
+    video_path, start_frame, end_frame = task
+    warm_start = max(start_frame - WARMUP_FRAMES, 0)
+    _blink_detector.reset(warm_start)
+    cap = open_at(video_path, warm_start)
+    chunks = []
+    chunk = np.empty(CHUNK_SIZE, dtype=np.float32)
+    filled = 0
+    frame_index = warm_start
+    start = time.perf_counter()
+    while end_frame is None or frame_index < end_frame:
+        success, frame = cap.read()
+        if not success:
+            break
+        _blink_detector.process_frame(frame)
+        frame_index += 1
+        if frame_index <= start_frame:
+            continue    # Warm-up frame
+        chunk[filled] = _blink_detector.last_ear
+        filled += 1
+        if filled == CHUNK_SIZE:
+            chunks.append(chunk)
+            chunk = np.empty(CHUNK_SIZE, dtype=np.float32)
+            filled = 0
+    cap.release()
+    chunks.append(chunk[:filled])
+    elapsed = time.perf_counter() - start
+    return video_path, start_frame, np.concatenate(chunks), elapsed, os.getpid()
+
+
+def save_ear(output_path, ear):
+    """
+    Saves per-frame eye aspect ratios as a float32 .npy array, where index i holds the value for frame i
+    :param output_path:<str> Path of the .npy file
+    :param ear:<array> Eye aspect ratio values
+    """
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    np.save(output_path, ear)
+
+
+def extract_all(tasks, workers, chunk_frames, verify):
+    """
+    Extracts eye aspect ratios from every video using a pool of worker processes and prints progress and throughput.
+    Videos longer than chunk_frames are split into frame ranges that are processed on separate workers and merged.
+    :param tasks:<list> (video path, output path) pairs
+    :param workers:<int> Number of worker processes
+    :param chunk_frames:<int> Number of frames per parallel chunk, 0 to process each video as one chunk
+    :param verify:<bool> Also process every video serially and check that the merged output matches
+    """
+    outputs = dict(tasks)
+    ranges = []
+    for video_path, _ in tasks:
+        ranges += [(video_path, start, end) for start, end in split_frames(count_frames(video_path), chunk_frames)]
+    remaining = {video_path: 0 for video_path, _ in tasks}
+    for video_path, _, _ in ranges:
+        remaining[video_path] += 1
+    parts = {video_path: [] for video_path, _ in tasks}
+    merged = {}
+    start = time.perf_counter()
+    total_frames = 0
+    with multiprocessing.Pool(max(min(workers, len(ranges)), 1), initializer=init_worker) as pool:
+        for done, (video_path, start_frame, ear, elapsed, pid) in enumerate(pool.imap_unordered(extract_range,
+                                                                                                  ranges), 1):
+            total_frames += len(ear)
+            print("[" + str(done) + "/" + str(len(ranges)) + "] " + video_path + " frames " + str(start_frame) + "-" +
+                  str(start_frame + len(ear)) + ": " + str(round(len(ear) / max(elapsed, 1e-9), 1)) +
+                  " frames/s (worker " + str(pid) + ")", flush=True)
+            parts[video_path].append((start_frame, ear))
+            remaining[video_path] -= 1
+            if remaining[video_path] == 0:
+                merged[video_path] = np.concatenate([part for _, part in sorted(parts.pop(video_path),
+                                                                                key=lambda item: item[0])])
+                save_ear(outputs[video_path], merged[video_path])
+        elapsed = time.perf_counter() - start
+        print("Processed " + str(total_frames) + " frames from " + str(len(tasks)) + " videos in " +
+              str(round(elapsed, 1)) + " s, " + str(round(total_frames / max(elapsed, 1e-9), 1)) + " frames/s overall")
+        if verify:
+            mismatched = 0
+            serial_ranges = [(video_path, 0, None) for video_path, _ in tasks]
+            for video_path, _, ear, _, _ in pool.imap_unordered(extract_range, serial_ranges):
+                if not np.array_equal(ear, merged[video_path]):
+                    mismatched += 1
+                    print("Mismatch between chunked and serial output: " + video_path)
+            print(str(len(tasks) - mismatched) + " of " + str(len(tasks)) + " videos match serial extraction")
+            if mismatched:
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calculate per-frame eye aspect ratios for video files")
+    parser.add_argument("paths", nargs="+", help="video files or directories of video files")
+    parser.add_argument("-o", "--output", default="ear_output", help="directory for the .npy outputs")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-c", "--chunk-frames", type=int, default=CHUNK_FRAMES,
+                        help="frames per parallel chunk of a single video, 0 to disable chunking")
+    parser.add_argument("--verify", action="store_true", help="check chunked output against serial extraction")
+    args = parser.parse_args()
+    extract_all(find_videos(args.paths, args.output), args.workers, args.chunk_frames, args.verify)
@@ -0,0 +1,296 @@
+import argparse
+import glob
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")  # File extensions read by ImageDirectorySource
+SESSION_EXTENSION = ".npy"  # File extension of recorded sessions, which have a .json sidecar with their timestamps
+DEFAULT_FPS = 30    # Frame rate assumed for sources that do not record one
+
+
+class FrameSource:
+    """
+    The FrameSource class is the interface the blink detector reads frames through. Like cv2.VideoCapture, reading is
+    split into grab, which advances to the next frame, and retrieve, which decodes it, so frames that will be dropped
+    are never decoded. Subclasses implement _grab, which returns a success flag and the frame's timestamp in seconds
+    from the start of the source, and _retrieve. Sources that are not live can be replayed at the pace they were
+    recorded at, or as fast as frames can be read when realtime is false.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime    # Wait until each frame's timestamp before returning it
+        self.timestamp = 0.0    # Timestamp of the last frame grabbed
+        self._start = None  # perf_counter time the first frame was returned
+
+    def open(self):
+        """
+        Acquires the underlying device or file
+        """
+        self._start = None
+
+    def close(self):
+        """
+        Releases the underlying device or file
+        """
+
+    def grab(self):
+        """
+        Advances to the next frame without decoding it. Returns a success flag.
+        """
+        success, timestamp = self._grab()
+        self.timestamp = timestamp
+        if success and self.realtime:
+            if self._start is None:
+                self._start = time.perf_counter() - timestamp
+            delay = self._start + timestamp - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return success
+
+    def retrieve(self):
+        """
+        Decodes the last grabbed frame. Returns a success flag and the frame.
+        """
+        return self._retrieve()
+
+    def read(self):
+        """
+        Grabs and decodes the next frame. Returns a success flag and the frame, like cv2.VideoCapture.read.
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def _grab(self):
+        raise NotImplementedError
+
+    def _retrieve(self):
+        raise NotImplementedError
+
+
+class CaptureSource(FrameSource):
+    """
+    Reads frames from an OpenCV video capture, a camera index or a video file
+    """
+
+    def __init__(self, device, realtime=False):
+        super(CaptureSource, self).__init__(realtime)
+        self.device = device    # Camera index or video file path
+        self._cap = None
+
+    def open(self):
+        super(CaptureSource, self).open()
+        if self._cap is None:
+            self._cap = cv2.VideoCapture(self.device)
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _grab(self):
+        if self._cap is None or not self._cap.grab():
+            return False, 0.0
+        return True, self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+
+    def _retrieve(self):
+        return self._cap.retrieve()
+
+
+class CameraSource(CaptureSource):
+    """
+    Reads live frames from a camera. Frames arrive at the camera's pace, so realtime pacing does not apply, and are
+    timestamped when they are grabbed. The camera is asked for a resolution suited to landmark detection and a one
+    frame buffer, so a grabbed frame is never stale. When gray is true the camera is also asked for raw YUYV output,
+    and the Y plane is returned as a 2-D grayscale frame without a colour conversion. Backends that ignore a request
+    keep their defaults, and frames are converted as needed. If the raw frames turn out not to be YUYV, the backend is
+    asked to decode frames again and the undecoded frame is dropped, so retrieve can fail for a single live frame.
+    """
+    RESOLUTION = (640, 480)     # Requested frame width and height, large enough for landmarks at DOWNSIZE_RATIO
+    BUFFER_SIZE = 1     # Requested number of frames buffered by the backend
+
+    def __init__(self, index=0, resolution=RESOLUTION, gray=True):
+        super(CameraSource, self).__init__(index, False)
+        self.resolution = resolution
+        self.gray = gray    # Return 2-D grayscale frames
+        self._raw = False   # True when the backend delivers raw YUYV frames
+        self._opened = 0.0  # perf_counter time the camera was opened
+
+    def open(self):
+        opened = self._cap is not None
+        super(CameraSource, self).open()
+        self._opened = time.perf_counter()
+        if opened or not self._cap.isOpened():
+            return
+        width, height = self.resolution
+        self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, CameraSource.BUFFER_SIZE)
+        self._raw = False
+        if self.gray and self._cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV")):
+            self._raw = bool(self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+    def _grab(self):
+        success = self._cap is not None and self._cap.grab()
+        return success, time.perf_counter() - self._opened
+
+    def _retrieve(self):
+        success, frame = self._cap.retrieve()
+        if not success:
+            return False, None
+        if self._raw:
+            # Raw YUYV holds Y and alternating U/V bytes per pixel, some backends return it as one flat row
+            width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if frame.size == width * height * 2:
+                return True, frame.reshape(height, width, 2)[:, :, 0]
+            # The backend delivers another raw format, such as MJPG, so let it decode the following frames and drop
+            # this undecoded one
+            self._raw = False
+            self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            return False, None
+        # Only decoded images are returned, never a raw buffer delivered as a single row
+        decoded = frame.ndim == 3 and frame.shape[2] == 3 or frame.ndim == 2 and frame.shape[0] > 1
+        if frame.dtype != np.uint8 or not decoded:
+            return False, None
+        if self.gray and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return True, frame
+
+
+class VideoFileSource(CaptureSource):
+    """
+    Reads frames from a video file, paced by the video's frame timestamps when realtime is true
+    """
+
+
+class ImageDirectorySource(FrameSource):
+    """
+    Reads the images in a directory in file name order as consecutive frames, fps frames per second apart
+    """
+
+    def __init__(self, path, fps=DEFAULT_FPS, realtime=False):
+        super(ImageDirectorySource, self).__init__(realtime)
+        self.fps = fps
+        self._paths = sorted(file for file in glob.glob(os.path.join(path, "*"))
+                             if file.lower().endswith(IMAGE_EXTENSIONS))
+        self._index = 0     # Index of the next image
+
+    def open(self):
+        super(ImageDirectorySource, self).open()
+        self._index = 0
+
+    def _grab(self):
+        if self._index >= len(self._paths):
+            return False, 0.0
+        self._index += 1
+        return True, (self._index - 1) / self.fps
+
+    def _retrieve(self):
+        frame = cv2.imread(self._paths[self._index - 1])
+        return frame is not None, frame
+
+
+class RecordedSession(FrameSource):
+    """
+    Replays a session saved by record: a .npy array of frames, memory-mapped so replay does not decode or copy them,
+    and a .json sidecar with each frame's timestamp. Frames may have been downscaled when they were recorded.
+    """
+
+    def __init__(self, path, realtime=False):
+        super(RecordedSession, self).__init__(realtime)
+        self.path = path
+        self._frames = None
+        self._timestamps = None
+        self._index = 0     # Index of the next frame
+
+    def open(self):
+        super(RecordedSession, self).open()
+        if self._frames is None:
+            self._frames = np.load(self.path, mmap_mode='r')
+            with open(os.path.splitext(self.path)[0] + ".json", "r") as file:
+                self._timestamps = json.load(file)['timestamps']
+        self._index = 0
+
+    def close(self):
+        self._frames = None
+
+    def _grab(self):
+        if self._frames is None or self._index >= len(self._frames):
+            return False, 0.0
+        self._index += 1
+        return True, self._timestamps[self._index - 1]
+
+    def _retrieve(self):
+        return True, self._frames[self._index - 1]
+
+    @staticmethod
+    def record(source, path, count, scale=1.0):
+        """
+        Reads up to count frames from a frame source and saves them as a recorded session
+        :param source:<FrameSource> The frame source, usually a camera
+        :param path:<str> Path of the .npy session file, the timestamps are written next to it as .json
+        :param count:<int> Maximum number of frames
+        :param scale:<float> Factor each frame is resized by before saving
+        """
+        frames = None
+        timestamps = []
+        source.open()
+        try:
+            while len(timestamps) < count:
+                success, frame = source.read()
+                if not success:
+                    break
+                if scale != 1.0:
+                    frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                if frames is None:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    frames = np.lib.format.open_memmap(path, mode='w+', dtype=frame.dtype, shape=(count,) + frame.shape)
+                frames[len(timestamps)] = frame
+                timestamps.append(source.timestamp)
+        finally:
+            source.close()
+        if frames is None:
+            raise ValueError("The frame source returned no frames")
+        if len(timestamps) < count:
+            # Rewrite the array without the unused rows
+            recorded = np.array(frames[:len(timestamps)])
+            del frames
+            np.save(path, recorded)
+        else:
+            frames.flush()
+        with open(os.path.splitext(path)[0] + ".json", "w") as file:
+            json.dump({'scale': scale, 'timestamps': timestamps}, file)
+
+
+def open_source(source, realtime=False):
+    """
+    Returns a frame source for a camera index, a directory of images, a recorded session file or a video file. Frame
+    sources are returned unchanged.
+    :param source:<object> Camera index, path or FrameSource
+    :param realtime:<bool> Replay files at the pace they were recorded at instead of as fast as possible
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int):
+        return CameraSource(source)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, realtime=realtime)
+    if source.lower().endswith(SESSION_EXTENSION):
+        return RecordedSession(source, realtime)
+    return VideoFileSource(source, realtime)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Record a session of camera or video frames for replay")
+    parser.add_argument("source", nargs="?", default="0", help="camera index or video file, camera 0 by default")
+    parser.add_argument("-o", "--output", default="session.npy", help="session file to write")
+    parser.add_argument("-n", "--frames", type=int, default=900, help="maximum number of frames to record")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="factor each frame is resized by")
+    args = parser.parse_args()
+    RecordedSession.record(open_source(int(args.source) if args.source.isdigit() else args.source), args.output,
+                           args.frames, args.scale)
+    print("Recorded " + args.output)
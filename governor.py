@@ -0,0 +1,77 @@
+class FrameRateGovernor:
+    """
+    The FrameRateGovernor class decides which captured frames the blink detector processes. It targets target_fps while
+    the user's eyes are active, lowers the rate to idle_fps once the eye aspect ratio has been steady for idle_after
+    seconds and to no_face_fps while no face is detected, and returns to target_fps as soon as the eye aspect ratio
+    drops below its running baseline, which is how every blink starts. Frames between processed frames are skipped
+    without running face or landmark detection.
+    """
+    TARGET_FPS = 30     # Processing rate while the eyes are active
+    IDLE_FPS = 15   # Processing rate while the eye aspect ratio is steady
+    NO_FACE_FPS = 5     # Processing rate while no face is detected
+    IDLE_AFTER = 1.0    # Seconds of steady eye aspect ratio before the rate is lowered
+    EAR_DROP_RATIO = 0.15   # Fraction the eye aspect ratio must fall below its baseline to count as dropping
+    BASELINE_WEIGHT = 0.05  # Weight of each processed frame in the running eye aspect ratio baseline
+
+    def __init__(self, target_fps=TARGET_FPS, idle_fps=IDLE_FPS, no_face_fps=NO_FACE_FPS, idle_after=IDLE_AFTER):
+        self.target_fps = target_fps
+        self.idle_fps = min(idle_fps, target_fps)
+        self.no_face_fps = min(no_face_fps, target_fps)
+        self.idle_after = idle_after
+        self.fps = target_fps   # Current processing rate
+        self._baseline = None   # Running average of the open eye aspect ratio
+        self._last_active = 0.0     # Time the eyes were last active
+        self._next_due = 0.0    # Time the next frame should be processed
+
+    def reset(self, timestamp=0.0):
+        """
+        Returns to the target rate and forgets the eye aspect ratio baseline
+        :param timestamp:<float> Current time in seconds
+        """
+        self.fps = self.target_fps
+        self._baseline = None
+        self._last_active = timestamp
+        self._next_due = timestamp
+
+    def due(self, timestamp):
+        """
+        Returns true if a frame captured at timestamp should be processed
+        :param timestamp:<float> Capture time of the frame in seconds
+        """
+        if timestamp < self._next_due:
+            return False
+        self._schedule(timestamp)
+        return True
+
+    def _schedule(self, timestamp):
+        """
+        Sets when the frame after one processed at timestamp is due. Frames arrive with some jitter, so the next frame
+        is due half a target interval early.
+        :param timestamp:<float> Capture time of the processed frame in seconds
+        """
+        self._next_due = timestamp + 1 / self.fps - 0.5 / self.target_fps
+
+    def update(self, face_found, ear, timestamp):
+        """
+        Adjusts the processing rate after a frame has been processed
+        :param face_found:<bool> True if a face was detected in the frame
+        :param ear:<float> Eye aspect ratio of the frame
+        :param timestamp:<float> Capture time of the frame in seconds
+        """
+        if not face_found:
+            self._baseline = None
+            self._last_active = timestamp
+            fps = self.no_face_fps
+        elif self._baseline is None:
+            self._baseline = ear
+            self._last_active = timestamp
+            fps = self.target_fps
+        elif ear < self._baseline * (1 - FrameRateGovernor.EAR_DROP_RATIO):
+            # The eyes are closing, so keep the baseline at the open eye value
+            self._last_active = timestamp
+            fps = self.target_fps
+        else:
+            self._baseline += (ear - self._baseline) * FrameRateGovernor.BASELINE_WEIGHT
+            fps = self.idle_fps if timestamp - self._last_active >= self.idle_after else self.target_fps
+        self.fps = fps
+        self._schedule(timestamp)
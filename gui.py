@@ -1,11 +1,10 @@
+import threading
 from PySide2 import QtGui
 from PySide2.QtWidgets import (QWidget, QDesktopWidget, QDialog, QPushButton,
                                QHBoxLayout, QVBoxLayout, QSizePolicy, QLabel, QFrame, QTabWidget, QScrollArea)
 from PySide2.QtCore import Slot, Qt, QTimer, QUrl
 from PySide2.QtGui import QFont
 from PySide2.QtMultimedia import QSoundEffect
-from blinkdetector import BlinkDetector
-from symbolmanager import SymbolManager
 
 
 global TEXT_TIMER_DELAY, TEXT_SIZE, OVERLAY_TEXT_SIZE
@@ -14,6 +13,21 @@ TEXT_SIZE = 14
 OVERLAY_TEXT_SIZE = 14
 
 
+def preload_modules():
+    """
+    Imports the blink detection and speech modules, loads the detection models and builds the word predictors. Runs on
+    a background thread once the main window is shown, so dlib, OpenCV, pyttsx3 and the word predictor do not delay
+    the first paint, and every session reuses the loaded models.
+    """
+    import blinkservice
+    import symbolmanager
+    import speech
+    # Starts the speech engine on its own thread and synthesizes the fixed phrases so they play instantly
+    speech.get_speech_worker().prewarm(symbolmanager.SymbolManager.SYMBOLS[2])
+    blinkservice.BlinkService.load_models()
+    symbolmanager.load_predictors()
+
+
 class MainWindow(QWidget):
     """
     Contains the MainWindow and DialogWindow classes, created using Qt for Python/PySide2.
@@ -58,8 +72,13 @@ class MainWindow(QWidget):
         self.dialog_window = None
         self.options_window = None
         self.help_window = None
+        self.blink_service = None   # Created when the blink controller is first started
         self.show()
 
+        # Import the heavy modules and load the models in the background so starting the blink controller is instant
+        self.preload_thread = threading.Thread(target=preload_modules, name="Preload", daemon=True)
+        self.preload_thread.start()
+
     @Slot()
     def button_start_clicked(self):
         """
@@ -71,12 +90,14 @@ class MainWindow(QWidget):
             self.button_start.setStyleSheet("background-color: lightgreen")
             self.dialog_window.close()
             self.dialog_window.destroy()
-            self.dialog_window.blink_detector = None
         else:
             self.input_enabled = True
             self.button_start.setText("Stop")
             self.button_start.setStyleSheet("background-color: lightcoral")
-            self.dialog_window = DialogWindow(self)
+            if self.blink_service is None:
+                from blinkservice import BlinkService   # Waits for the preload thread if it is still importing
+                self.blink_service = BlinkService(0)
+            self.dialog_window = DialogWindow(self, self.blink_service)
 
     @Slot()
     def button_options_clicked(self):
@@ -284,10 +305,12 @@ class HelpWindow(QDialog):
 class DialogWindow(QDialog):
     global TEXT_TIMER_DELAY, OVERLAY_TEXT_SIZE, TEXT_SIZE
     PAUSE_TIMER_DELAY = 100     # Defines the delay for the visual feedback when a blink is detected
+    LATENCY_TIMER_DELAY = 1000  # Delay between updates of the latency overlay
+    LATENCY_DUMP_PATHS = ("latency.json", "latency.csv")    # Files the recorded stage latencies are dumped to
     WINDOW_HEIGHT = 60      # Height of the dialog window
     WINDOW_WIDTH = 800      # Width of the dialog window
 
-    def __init__(self, parent):
+    def __init__(self, parent, blink_service):
         super(DialogWindow, self).__init__(parent)
 
         # Window configurations
@@ -295,7 +318,10 @@ class DialogWindow(QDialog):
         self.setGeometry(0, 0, DialogWindow.WINDOW_WIDTH, DialogWindow.WINDOW_HEIGHT)
         self.setContentsMargins(1, 1, 1, 1)
 
+        from symbolmanager import SymbolManager     # Imported on the preload thread at startup
+        from speech import get_speech_player
         self.symbol_manager = SymbolManager()
+        self.speech_player = get_speech_player()    # Plays cached utterances on the GUI thread
 
         self.setStyleSheet("border: 1px solid black")
 
@@ -356,6 +382,11 @@ class DialogWindow(QDialog):
         self.detected_label.setFont(QFont("Helvetica", OVERLAY_TEXT_SIZE))
         self.detected_label.hide()
 
+        self.latency_label = QLabel("")
+        self.latency_label.setStyleSheet("border: none; font: 8pt")
+        self.latency_label.setAlignment(Qt.AlignCenter)
+        self.latency_label.hide()
+
         # Create layouts to hold the labels
         self.suggestion_labels = QHBoxLayout()
         self.suggestion_labels.addWidget(self.suggestion_label1)
@@ -374,30 +405,30 @@ class DialogWindow(QDialog):
         self.v_layout.addLayout(self.suggestion_labels)
         self.v_layout.addLayout(self.input_labels)
         self.v_layout.addWidget(self.detected_label)
+        self.v_layout.addWidget(self.latency_label)
         self.setLayout(self.v_layout)
 
         # Initialize timers
         self.text_timer = QTimer()
         self.text_timer.timeout.connect(self.symbol_scroll)
 
-        self.blink_detector = BlinkDetector(0, False)
-        self.blink_detector.face_detected.connect(self.update_detected_label)
-        self.blink_detector.blink_detected.connect(self.handle_blink_start)
+        self.blink_service = blink_service
 
         self.word_predictions = ["", "", ""]
 
-        self.blink_timer = QTimer()
-        self.blink_timer.timeout.connect(self.blink_detector.check_frame)
-
         self.pause_timer = QTimer()
         self.pause_timer.timeout.connect(self.handle_blink_end)
 
+        self.latency_timer = QTimer()
+        self.latency_timer.timeout.connect(self.update_latency_label)
+
         self.blink_sound = QSoundEffect()
         self.blink_sound.setSource(QUrl.fromLocalFile("resources/sounds/ui_blink.wav"))
 
         self.move_top_middle()
         self.show()
-        self.blink_timer.start()
+        self.blink_detector = self.blink_service.attach(self.update_detected_label, self.handle_blink_start,
+                                                        self.show_error)
         self.text_timer.start(TEXT_TIMER_DELAY)
 
     @Slot()
@@ -418,10 +449,12 @@ class DialogWindow(QDialog):
         Implements all the functionality needed after a blink is detected
         """
         # Pause operation
-        self.blink_timer.stop()
+        self.blink_service.pause()
         self.text_timer.stop()
         # Give auditory and visual feedback
         self.input_label3.setStyleSheet("background-color: lightgreen; color: black;")
+        self.input_label3.repaint()
+        self.blink_service.mark_blink_shown()
         self.blink_sound.play()
         # Wait 0.1 sec
         self.pause_timer.start(DialogWindow.PAUSE_TIMER_DELAY)
@@ -446,7 +479,7 @@ class DialogWindow(QDialog):
         self.suggestion_label3.setText(self.word_predictions[2])
         # Commence operation
         self.text_timer.start(TEXT_TIMER_DELAY)
-        self.blink_timer.start()
+        self.blink_service.resume()
         self.pause_timer.stop()
 
     def move_top_middle(self):
@@ -456,6 +489,26 @@ class DialogWindow(QDialog):
         resolution = QDesktopWidget().screenGeometry()
         self.move((resolution.width() / 2) - (self.frameSize().width() / 2), 0)
 
+    @Slot()
+    def update_latency_label(self):
+        """
+        Shows the rolling stage latency percentiles in the latency overlay
+        """
+        self.latency_label.setText(self.blink_service.latency.summary() + ", dropped frames " +
+                                   str(self.blink_service.blink_pipeline.dropped_frames))
+
+    def toggle_latency_label(self):
+        """
+        Shows or hides the latency overlay
+        """
+        if self.latency_label.isVisible():
+            self.latency_timer.stop()
+            self.latency_label.hide()
+        else:
+            self.update_latency_label()
+            self.latency_label.show()
+            self.latency_timer.start(DialogWindow.LATENCY_TIMER_DELAY)
+
     @Slot(bool)
     def update_detected_label(self, face_detected):
         """
@@ -478,12 +531,43 @@ class DialogWindow(QDialog):
             self.suggestion_label2.hide()
             self.suggestion_label3.hide()
 
+    @Slot(str)
+    def show_error(self, message):
+        """
+        Tells the user that blink detection stopped because of an error, and stops scrolling the symbols
+        :param message:<str> Description of the error
+        """
+        self.text_timer.stop()
+        self.pause_timer.stop()
+        self.suggestion_label1.setText("Blink detection stopped. " + message)
+        self.suggestion_label1.setStyleSheet("background-color: lightcoral; border: none")
+        self.suggestion_label2.hide()
+        self.suggestion_label3.hide()
+
+    def closeEvent(self, event):
+        """
+        Detaches from the blink service when the dialog is closed, which stops capture and releases the camera
+        """
+        self.text_timer.stop()
+        self.pause_timer.stop()
+        self.latency_timer.stop()
+        self.blink_service.detach()
+        event.accept()
+
     def keyPressEvent(self, event):
         """
-        Space key mimicing a blink for debugging purposes
+        Escape stops speech. Debugging keys: space mimics a blink, L toggles the latency overlay and D dumps the
+        recorded latencies.
         """
-        if event.key() == Qt.Key_Space:
+        if event.key() == Qt.Key_Escape:
+            self.symbol_manager.speech.cancel()
+        elif event.key() == Qt.Key_Space:
             self.handle_blink_start()
+        elif event.key() == Qt.Key_L:
+            self.toggle_latency_label()
+        elif event.key() == Qt.Key_D:
+            for path in DialogWindow.LATENCY_DUMP_PATHS:
+                self.blink_service.latency.dump(path)
         event.accept()
 
 
@@ -0,0 +1,108 @@
+import csv
+import json
+import time
+import numpy as np
+
+
+class LatencyMonitor:
+    """
+    The LatencyMonitor class records when each frame passes every stage of the capture to GUI path. Timestamps are
+    written into a preallocated ring buffer with one row per frame, so recording costs a clock read and an array store.
+    Each stage's latency is the time since the previous recorded stage of the same frame, and rolling percentiles are
+    computed over the buffered frames on request.
+    """
+    STAGES = ('capture', 'preprocess', 'detect', 'landmark', 'ear', 'classify', 'emit', 'repaint')   # In path order
+    PERCENTILES = (50, 95, 99)  # Percentiles reported by stats
+    BUFFER_SIZE = 1024  # Number of frames kept
+
+    def __init__(self, size=BUFFER_SIZE):
+        self._times = np.full((size, len(LatencyMonitor.STAGES) + 1), np.nan)  # Start and stage timestamps per frame
+        self._columns = {stage: i + 1 for i, stage in enumerate(LatencyMonitor.STAGES)}
+        self._next_row = 0  # Row the next frame is recorded in
+        self._count = 0     # Number of frames recorded, up to the buffer size
+
+    def begin(self):
+        """
+        Starts recording a new frame and returns its row, which is passed to mark for each stage of that frame
+        """
+        row = self._next_row
+        self._times[row] = np.nan
+        self._times[row, 0] = time.perf_counter()
+        self._next_row = (row + 1) % len(self._times)
+        self._count = min(self._count + 1, len(self._times))
+        return row
+
+    def mark(self, row, stage):
+        """
+        Records that a frame has finished a stage
+        :param row:<int> Row returned by begin for the frame
+        :param stage:<str> Name of the finished stage, one of STAGES
+        """
+        self._times[row, self._columns[stage]] = time.perf_counter()
+
+    def discard(self, row):
+        """
+        Forgets a frame that was dropped before it was processed, so it does not count towards the stats
+        :param row:<int> Row returned by begin for the frame
+        """
+        self._times[row] = np.nan
+
+    def durations(self):
+        """
+        Returns a (frames, stages) array of stage latencies in seconds, NaN where a frame skipped a stage
+        """
+        times = self._times[:self._count]
+        # Timestamps only increase along a row, so a running maximum carries the last recorded stage forward
+        previous = np.fmax.accumulate(times, axis=1)[:, :-1]
+        return times[:, 1:] - previous
+
+    def stats(self):
+        """
+        Returns a dictionary mapping each stage, and 'total' for capture start to the last recorded stage, to its frame
+        count and rolling percentile latencies in milliseconds. Totals only count frames that reached the ear stage, so
+        frames that stopped early do not lower them.
+        """
+        durations = self.durations()
+        times = self._times[:self._count]
+        # fmax skips NaN, and frames that did not reach the ear stage are set to NaN and left out below
+        totals = np.fmax.reduce(times[:, 1:], axis=1) - times[:, 0]
+        totals[np.isnan(times[:, self._columns['ear']])] = np.nan
+        columns = list(zip(LatencyMonitor.STAGES, durations.T)) + [('total', totals)]
+        stats = {}
+        for stage, values in columns:
+            values = values[np.isfinite(values)] * 1000
+            stats[stage] = {'count': int(len(values))}
+            for percentile in LatencyMonitor.PERCENTILES:
+                stats[stage]['p' + str(percentile)] = float(np.percentile(values, percentile)) if len(values) else None
+        return stats
+
+    def summary(self, stages=('detect', 'landmark', 'classify', 'total')):
+        """
+        Returns a one line description of the rolling percentiles of the specified stages
+        :param stages:<tuple> Stages to be described
+        """
+        stats = self.stats()
+        parts = []
+        for stage in stages:
+            values = [stats[stage]['p' + str(p)] for p in LatencyMonitor.PERCENTILES]
+            parts.append(stage + " " + "/".join("-" if v is None else str(round(v, 1)) for v in values))
+        return "p" + "/".join(str(p) for p in LatencyMonitor.PERCENTILES) + " ms: " + ", ".join(parts)
+
+    def dump(self, file_path):
+        """
+        Writes the recorded stage latencies to a file. A .csv file gets one row per frame with a column per stage in
+        milliseconds, any other file gets the percentile stats and per-frame latencies as JSON.
+        :param file_path:<str> Path of the output file
+        """
+        durations = self.durations() * 1000
+        if file_path.lower().endswith(".csv"):
+            with open(file_path, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(LatencyMonitor.STAGES)
+                for row in durations:
+                    writer.writerow(["" if np.isnan(value) else round(value, 4) for value in row])
+        else:
+            frames = [{stage: float(value) for stage, value in zip(LatencyMonitor.STAGES, row) if not np.isnan(value)}
+                      for row in durations]
+            with open(file_path, "w") as file:
+                json.dump({'stats': self.stats(), 'frames_ms': frames}, file, indent=1)
@@ -2,11 +2,32 @@
 # Contains the main function which creates a QApplication.
 # ----------------------------------------------------------------------------------------------------------------------
 # pyinstaller main.py -F -w -i resources/icon.ico
+import time
+START_TIME = time.perf_counter()    # Used by the startup benchmark
+import json
+import os
 import sys
+from PySide2.QtCore import QTimer
 from PySide2.QtWidgets import (QApplication)
 from gui import MainWindow
+IMPORT_TIME = time.perf_counter()
+
+STARTUP_BENCHMARK_ENV = "BLINK2TALK_STARTUP_BENCHMARK"  # When set, print startup timings and quit after the first paint
+
+
+def report_startup():
+    """
+    Prints the import and first paint times in seconds as JSON and quits. Scheduled right after the main window is
+    shown, so it runs once the event loop has painted the window.
+    """
+    print(json.dumps({'import_s': IMPORT_TIME - START_TIME, 'first_paint_s': time.perf_counter() - START_TIME}),
+          flush=True)
+    QApplication.quit()
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
+    if os.environ.get(STARTUP_BENCHMARK_ENV):
+        QTimer.singleShot(0, report_startup)
     sys.exit(app.exec_())
@@ -0,0 +1,191 @@
+import argparse
+import collections
+import json
+import os
+import re
+import numpy as np
+from wordpredictor import load_word_counts
+
+MODEL_PATH = "resources/ngram.npy"  # Next word model built by build_model, with a .json sidecar of its vocabulary
+MODEL_VERSION = 1   # Incremented whenever the model layout changes
+SUGGESTIONS = 3     # Number of next words stored per context and suggested
+MAX_VOCABULARY = 20000  # Maximum number of words in a built model
+MIN_COUNT = 2   # Minimum number of times a word or context must occur in the corpus to be kept
+START = ""  # Marks the start of a sentence in a context
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase words
+    :param text:<str> The text
+    """
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def split_sentences(lines):
+    """
+    Yields the words of each sentence in lines of text, where sentences end at line breaks and . ! ?
+    :param lines:<iterable> Lines of text
+    """
+    for line in lines:
+        for sentence in re.split(r"[.!?]+", line):
+            words = tokenize(sentence)
+            if words:
+                yield words
+
+
+def count_contexts(sentences):
+    """
+    Counts the words following every one and two word context. Returns a dictionary mapping each context tuple to a
+    Counter of next words. Contexts at the start of a sentence begin with START.
+    :param sentences:<iterable> Lists of words
+    """
+    contexts = collections.defaultdict(collections.Counter)
+    for words in sentences:
+        previous = (START, START)
+        for word in words:
+            contexts[previous[1:]][word] += 1
+            contexts[previous][word] += 1
+            previous = (previous[1], word)
+    return contexts
+
+
+def context_key(ids, vocabulary_size):
+    """
+    Returns the integer key of a context of one or two word ids, where id 0 is START and words are numbered from 1.
+    One word contexts are keyed by the word id and two word contexts by a number above every one word key.
+    :param ids:<tuple> Word ids of the context, oldest first
+    :param vocabulary_size:<int> Number of words in the vocabulary
+    """
+    if len(ids) == 1:
+        return ids[0]
+    return (ids[0] + 1) * (vocabulary_size + 1) + ids[1]
+
+
+def build_model(corpus_paths, output_path=MODEL_PATH, max_vocabulary=MAX_VOCABULARY, min_count=MIN_COUNT):
+    """
+    Builds a bigram and trigram next word model from text files. The model is a .npy array with one record per context,
+    sorted by context key and holding the ids of its SUGGESTIONS most frequent next words, so a lookup is a binary
+    search of a memory-mapped array. A .json sidecar holds the vocabulary and the most frequent words overall.
+    :param corpus_paths:<list> Paths of the text files
+    :param output_path:<str> Path of the .npy model file
+    :param max_vocabulary:<int> Maximum number of words in the model
+    :param min_count:<int> Minimum number of times a word or context must occur to be kept
+    """
+    sentences = []
+    for path in corpus_paths:
+        with open(path, "r", encoding="utf-8", errors="ignore") as file:
+            sentences.extend(split_sentences(file))
+    word_counts = collections.Counter(word for words in sentences for word in words)
+    vocabulary = [word for word, count in word_counts.most_common(max_vocabulary) if count >= min_count]
+    ids = {word: i + 1 for i, word in enumerate(vocabulary)}
+    ids[START] = 0
+    records = []
+    for context, next_words in count_contexts(sentences).items():
+        if any(word not in ids for word in context) or sum(next_words.values()) < min_count:
+            continue
+        best = [ids[word] for word, _ in next_words.most_common() if word in ids][:SUGGESTIONS]
+        records.append((context_key(tuple(ids[word] for word in context), len(vocabulary)),
+                        best + [-1] * (SUGGESTIONS - len(best))))
+    records.sort()
+    data = np.empty(len(records), dtype=[('context', '<u8'), ('next', '<i4', (SUGGESTIONS,))])
+    data['context'] = [key for key, _ in records]
+    data['next'] = np.array([best for _, best in records], dtype=np.int32).reshape(-1, SUGGESTIONS)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    np.save(output_path, data)
+    with open(os.path.splitext(output_path)[0] + ".json", "w") as file:
+        json.dump({'version': MODEL_VERSION, 'vocabulary': vocabulary, 'unigrams': vocabulary[:SUGGESTIONS]}, file)
+    return len(vocabulary), len(records)
+
+
+class NgramModel:
+    """
+    The NgramModel class suggests the next word from the one or two words before it. Trigram contexts are tried first,
+    then the model backs off to bigram contexts and finally to the most frequent words. A model built from a corpus
+    by build_model is memory-mapped, and sentences the user speaks are learned into small in-memory counts that are
+    consulted before the built model at each order. Learned sentences are never written to disk. Without a built
+    model, the most frequent words of the word list are the last resort.
+    """
+
+    def __init__(self, model_path=MODEL_PATH):
+        self._keys = np.empty(0, dtype=np.uint64)   # Sorted context keys of the built model
+        self._next = np.empty((0, SUGGESTIONS), dtype=np.int32)     # Next word ids of each context
+        self._vocabulary = []   # Words of the built model, id i + 1 is vocabulary[i]
+        self._ids = {}  # Word to id in the built model
+        self._unigrams = [word for word, _ in sorted(load_word_counts().items(), key=lambda item: -item[1])
+                          [:SUGGESTIONS]]
+        self._learned = collections.defaultdict(collections.Counter)   # Context to next word counts of the user
+        header = None
+        try:
+            with open(os.path.splitext(model_path)[0] + ".json", "r") as file:
+                header = json.load(file)
+        except (OSError, ValueError):
+            pass
+        if header is not None and header.get('version') == MODEL_VERSION and os.path.exists(model_path):
+            data = np.load(model_path, mmap_mode='r')
+            self._keys, self._next = data['context'], data['next']
+            self._vocabulary = header['vocabulary']
+            self._ids = {word: i + 1 for i, word in enumerate(self._vocabulary)}
+            self._ids[START] = 0
+            self._unigrams = header['unigrams'] or self._unigrams
+
+    def _learn_words(self, words):
+        """
+        Adds the word sequences of a sentence to the learned counts
+        :param words:<list> Words of the sentence
+        """
+        for context, next_words in count_contexts([words]).items():
+            self._learned[context].update(next_words)
+
+    def learn(self, text):
+        """
+        Learns the word sequences of a sentence the user entered, in memory for the rest of the session
+        :param text:<str> The sentence
+        """
+        for words in split_sentences([text]):
+            self._learn_words(words)
+
+    def _lookup(self, context):
+        """
+        Returns the built model's next words for a context, or an empty list if the context is not in the model
+        :param context:<tuple> Words of the context, oldest first
+        """
+        if any(word not in self._ids for word in context):
+            return []
+        key = context_key(tuple(self._ids[word] for word in context), len(self._vocabulary))
+        i = int(np.searchsorted(self._keys, np.uint64(key)))
+        if i == len(self._keys) or self._keys[i] != key:
+            return []
+        return [self._vocabulary[j - 1] for j in self._next[i] if j > 0]
+
+    def predict(self, words):
+        """
+        Returns SUGGESTIONS next word suggestions for a sentence
+        :param words:<list> The lowercase words of the sentence so far, only the last two are used
+        """
+        previous = (START, START) + tuple(words[-2:])
+        suggestions = []
+        for context in (previous[-2:], previous[-1:]):
+            candidates = [word for word, _ in self._learned[context].most_common(SUGGESTIONS)] \
+                if context in self._learned else []
+            for word in candidates + self._lookup(context):
+                if word not in suggestions:
+                    suggestions.append(word)
+            if len(suggestions) >= SUGGESTIONS:
+                return np.array(suggestions[:SUGGESTIONS])
+        for word in self._unigrams:
+            if word not in suggestions and len(suggestions) < SUGGESTIONS:
+                suggestions.append(word)
+        return np.array(suggestions + [""] * (SUGGESTIONS - len(suggestions)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the next word model from text files")
+    parser.add_argument("corpus", nargs="+", help="text files with one or more sentences per line")
+    parser.add_argument("-o", "--output", default=MODEL_PATH, help="model file to write")
+    parser.add_argument("--max-vocabulary", type=int, default=MAX_VOCABULARY, help="maximum number of words")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT,
+                        help="minimum number of times a word or context must occur")
+    args = parser.parse_args()
+    vocabulary_size, context_count = build_model(args.corpus, args.output, args.max_vocabulary, args.min_count)
+    print("Built " + args.output + " with " + str(vocabulary_size) + " words and " + str(context_count) + " contexts")
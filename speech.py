@@ -0,0 +1,352 @@
+import collections
+import hashlib
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import wave
+import pyttsx3
+from pyttsx3.drivers import sapi5
+from PySide2.QtCore import QObject, Qt, QUrl, Signal, Slot
+from PySide2.QtMultimedia import QSoundEffect
+
+CACHE_DIR = "resources/speech_cache"    # Directory holding synthesized utterances
+_speech_worker = None   # SpeechWorker shared by every symbol manager in the process
+_speech_worker_lock = threading.Lock()
+_speech_player = None   # SpeechPlayer shared by every dialog window in the process
+
+
+def get_speech_worker():
+    """
+    Returns the process-wide speech worker, starting it on first use. Safe to call from several threads.
+    """
+    global _speech_worker
+    with _speech_worker_lock:
+        if _speech_worker is None:
+            _speech_worker = SpeechWorker(AudioCache())
+            _speech_worker.start()
+        return _speech_worker
+
+
+def get_speech_player():
+    """
+    Returns the process-wide speech player, creating it on first use. Must be called on the GUI thread.
+    """
+    global _speech_player
+    if _speech_player is None:
+        _speech_player = SpeechPlayer(get_speech_worker())
+    return _speech_player
+
+
+def normalize_text(text):
+    """
+    Returns text with surrounding whitespace removed and runs of whitespace collapsed, as it is spoken and cached
+    :param text:<str> The text
+    """
+    return " ".join(text.split())
+
+
+class AudioCache:
+    """
+    The AudioCache class stores synthesized utterances as wave files, keyed by the text and the voice settings it was
+    spoken with. When the cache holds more than max_files files or max_bytes bytes, the least recently used files are
+    deleted. A file's modification time records when it was last used.
+    """
+    MAX_FILES = 500     # Maximum number of cached utterances
+    MAX_BYTES = 100 * 1024 * 1024   # Maximum total size of the cached utterances
+
+    def __init__(self, cache_dir=CACHE_DIR, max_files=MAX_FILES, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+
+    def path(self, text, voice):
+        """
+        Returns the path an utterance is cached at
+        :param text:<str> The normalized text
+        :param voice:<dict> Voice settings of the speech engine
+        """
+        key = hashlib.sha1(json.dumps([text, voice], sort_keys=True).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".wav")
+
+    def get(self, text, voice):
+        """
+        Returns the path of a cached utterance and marks it as recently used, or None if it is not cached
+        :param text:<str> The normalized text
+        :param voice:<dict> Voice settings of the speech engine
+        """
+        path = self.path(text, voice)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def evict(self):
+        """
+        Deletes the least recently used utterances until the cache is within its limits
+        """
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".wav")]
+        except OSError:
+            return
+        stats = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+        total = 0
+        for i, (_, size, path) in enumerate(stats):
+            total += size
+            if i >= self.max_files or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class SpeechWorker(QObject):
+    """
+    The SpeechWorker class speaks queued utterances on a worker thread, so text to speech never blocks the GUI or blink
+    detection. The pyttsx3 engine is created on the worker thread, which owns it for the life of the process, since
+    the speech drivers expect to be used from the thread that created them. The current utterance can be cancelled
+    between words and pending utterances discarded. Signals are emitted from the worker thread, so slots connected to
+    them should use queued connections.
+
+    Spoken utterances are synthesized into an audio cache, and prewarm synthesizes fixed phrases ahead of time. These
+    cache jobs have a lower priority than utterances, so they only run while nothing waits to be spoken. Once a speech
+    player is attached, cached utterances are not synthesized again but handed to the player through audio_ready, and
+    the worker waits for their duration so queued utterances do not overlap.
+    """
+    PRIORITIES = {'stop': 0, 'say': 1, 'cache': 2}    # Queue priority of each kind of job, lowest first
+    utterance_started = Signal(str)
+    utterance_finished = Signal(str, bool)  # The utterance and whether it was spoken to the end
+    audio_ready = Signal(str)   # Path of a cached utterance to be played now
+    audio_cached = Signal(str)  # Path of an utterance that was added to the cache
+    cancelled = Signal()    # Emitted when speech is cancelled
+
+    def __init__(self, audio_cache=None):
+        super(SpeechWorker, self).__init__()
+        self.audio_cache = audio_cache  # AudioCache of synthesized utterances, None to always synthesize
+        self.player_attached = False    # True once a speech player plays the cached utterances
+        self.prewarmed = []     # Normalized phrases passed to prewarm, in the order they were first queued
+        self._jobs = queue.PriorityQueue()  # (priority, sequence, job) of ('say' or 'cache', text) jobs or None to stop
+        self._sequence = itertools.count()  # Keeps jobs of the same priority in the order they were queued
+        self._cancelled = threading.Event()     # Set to stop the current utterance
+        self._speaking = False  # True while the engine speaks aloud rather than synthesizing into the cache
+        self._engine = None
+        self._voice = None  # Voice settings of the engine, part of the audio cache key
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the worker thread, which initializes the speech engine
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._speak_loop, name="Speech", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Cancels all speech and waits for the worker thread to finish
+        """
+        self.cancel()
+        if self._thread is not None:
+            self._put(None)
+            self._thread.join()
+            self._thread = None
+
+    def say(self, text):
+        """
+        Queues text to be spoken after any utterances already queued
+        :param text:<str> The text to be spoken
+        """
+        text = normalize_text(text)
+        if text:
+            self._put(('say', text))
+
+    def prewarm(self, texts):
+        """
+        Queues phrases to be synthesized into the audio cache if they are not cached yet. Once a speech player is
+        attached, phrases that are already cached are handed to it through audio_cached so it loads them.
+        :param texts:<list> The phrases
+        """
+        if self.audio_cache is not None:
+            for text in texts:
+                text = normalize_text(text)
+                if text:
+                    if text not in self.prewarmed:
+                        self.prewarmed.append(text)
+                    self._put(('cache', text))
+
+    def _put(self, job):
+        """
+        Queues a job behind the queued jobs of the same or a higher priority
+        :param job:<tuple> ('say' or 'cache', text) job, None to stop the worker
+        """
+        priority = SpeechWorker.PRIORITIES['stop' if job is None else job[0]]
+        self._jobs.put((priority, next(self._sequence), job))
+
+    def interrupt(self, text):
+        """
+        Cancels the current and queued utterances and speaks text instead
+        :param text:<str> The text to be spoken
+        """
+        self.cancel()
+        self.say(text)
+
+    def cancel(self):
+        """
+        Discards the queued utterances and stops the current one at the next word. Queued cache jobs are kept.
+        """
+        kept = []
+        while True:
+            try:
+                item = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if item[2] is None or item[2][0] != 'say':
+                kept.append(item)
+        for item in kept:
+            self._jobs.put(item)
+        self._cancelled.set()
+        self.cancelled.emit()
+
+    def _on_word(self, name, location, length):
+        """
+        Called by the speech engine before each word, stops the utterance if it was cancelled
+        """
+        if self._speaking and self._cancelled.is_set():
+            self._engine.stop()
+
+    def _synthesize(self, text):
+        """
+        Synthesizes text into the audio cache and returns its path
+        :param text:<str> The normalized text
+        """
+        path = self.audio_cache.path(text, self._voice)
+        os.makedirs(self.audio_cache.cache_dir, exist_ok=True)
+        # Written under a temporary name so a partly written file is never played
+        temp_path = path[:-len(".wav")] + ".tmp.wav"
+        self._engine.save_to_file(text, temp_path)
+        self._engine.runAndWait()
+        if not os.path.exists(temp_path):
+            return None
+        os.replace(temp_path, path)
+        self.audio_cache.evict()
+        self.audio_cached.emit(path)
+        return path
+
+    def _play_cached(self, path):
+        """
+        Hands a cached utterance to the speech player and waits until it has played or speech is cancelled
+        :param path:<str> Path of the cached utterance
+        """
+        try:
+            with wave.open(path, "rb") as file:
+                duration = file.getnframes() / file.getframerate()
+        except (OSError, EOFError, wave.Error):
+            return False
+        self.audio_ready.emit(path)
+        self._cancelled.wait(duration)
+        return True
+
+    def _speak_loop(self):
+        """
+        Speaks queued utterances until stopped
+        """
+        if sys.platform == 'win32':
+            # COM is initialized per thread, and the SAPI5 driver creates its COM objects on this thread
+            import comtypes
+            comtypes.CoInitialize()
+        try:
+            self._run_engine()
+        finally:
+            self._engine = None
+            if sys.platform == 'win32':
+                comtypes.CoUninitialize()
+
+    def _run_engine(self):
+        """
+        Initializes the speech engine and speaks queued utterances until stopped
+        """
+        self._engine = pyttsx3.init()
+        self._engine.connect('started-word', self._on_word)
+        voice = self._engine.getProperty('voice')
+        self._voice = {'voice': str(voice), 'rate': self._engine.getProperty('rate'),
+                       'volume': self._engine.getProperty('volume')}
+        while True:
+            _, _, job = self._jobs.get()
+            if job is None:
+                break
+            kind, text = job
+            cached = self.audio_cache.get(text, self._voice) if self.audio_cache is not None else None
+            if kind == 'cache':
+                if cached is None:
+                    self._synthesize(text)
+                elif self.player_attached:
+                    self.audio_cached.emit(cached)
+                continue
+            self._cancelled.clear()
+            self.utterance_started.emit(text)
+            if cached is None or not self.player_attached or not self._play_cached(cached):
+                self._speaking = True
+                self._engine.say(text)
+                self._engine.runAndWait()
+                self._speaking = False
+                if self.audio_cache is not None and not self._cancelled.is_set():
+                    # Synthesized once nothing waits to be spoken, so queued utterances are not delayed
+                    self._put(('cache', text))
+            self.utterance_finished.emit(text, not self._cancelled.is_set())
+
+
+class SpeechPlayer(QObject):
+    """
+    The SpeechPlayer class plays cached utterances on the GUI thread through QSoundEffect, which plays uncompressed
+    audio with low latency. Sound effects for the most recently used utterances are kept loaded, up to MEMORY_SIZE, so
+    prewarmed phrases start playing almost immediately.
+    """
+    MEMORY_SIZE = 32    # Number of loaded sound effects kept in memory
+
+    def __init__(self, speech_worker):
+        super(SpeechPlayer, self).__init__()
+        self._effects = collections.OrderedDict()   # Path to loaded QSoundEffect, least recently used first
+        self._playing = None    # Sound effect currently playing
+        speech_worker.audio_ready.connect(self.play, Qt.QueuedConnection)
+        speech_worker.audio_cached.connect(self.load, Qt.QueuedConnection)
+        speech_worker.cancelled.connect(self.stop, Qt.QueuedConnection)
+        speech_worker.player_attached = True
+        # Phrases prewarmed before the player existed were cached without being loaded, so they are loaded now
+        speech_worker.prewarm(list(speech_worker.prewarmed))
+
+    @Slot(str)
+    def load(self, path):
+        """
+        Loads a cached utterance into memory and returns its sound effect
+        :param path:<str> Path of the cached utterance
+        """
+        effect = self._effects.pop(path, None)
+        if effect is None:
+            effect = QSoundEffect()
+            effect.setSource(QUrl.fromLocalFile(os.path.abspath(path)))
+        self._effects[path] = effect
+        while len(self._effects) > SpeechPlayer.MEMORY_SIZE:
+            self._effects.popitem(last=False)
+        return effect
+
+    @Slot(str)
+    def play(self, path):
+        """
+        Plays a cached utterance
+        :param path:<str> Path of the cached utterance
+        """
+        self.stop()
+        self._playing = self.load(path)
+        self._playing.play()
+
+    @Slot()
+    def stop(self):
+        """
+        Stops the utterance being played
+        """
+        if self._playing is not None:
+            self._playing.stop()
+            self._playing = None
@@ -1,7 +1,23 @@
-import pyttsx3
-from pyttsx3.drivers import sapi5
+import threading
+from ngram import NgramModel, tokenize
+from speech import get_speech_worker
 from wordpredictor import WordPredictor
 
+_predictors = None  # (word predictor, next word model) shared by every symbol manager in the process
+_predictors_lock = threading.Lock()
+
+
+def load_predictors():
+    """
+    Builds the word predictor and next word model once per process and returns them. Safe to call from several
+    threads, later callers wait for the first build to finish.
+    """
+    global _predictors
+    with _predictors_lock:
+        if _predictors is None:
+            _predictors = (WordPredictor(), NgramModel())
+        return _predictors
+
 
 class SymbolManager:
     """
@@ -18,8 +34,9 @@ class SymbolManager:
         self.current_set = 0     # The index for a set in the SYMBOLS array
         self.current_symbol = 0     # The index for the current symbol in SYMBOLS array
         self.symbol_output = []     # Contains a list of symbols for output
-        self.tts = pyttsx3.init()       # Text to speech object
-        self.word_predictor = WordPredictor()    # Word prediction object
+        self.speech = get_speech_worker()       # Text to speech worker shared by the process
+        # Word prediction and next word prediction objects, built on the preload thread at startup
+        self.word_predictor, self.next_word_model = load_predictors()
         self.word_predictions = ["", "", ""]    # Holds three word predictions
 
     def scroll_symbols(self):
@@ -39,6 +56,27 @@ class SymbolManager:
             out += self.symbol_output[i]
         return out
 
+    def get_last_token(self):
+        """
+        Returns the lowercase word being typed, made of the symbols after the last symbol containing a space
+        """
+        token = []
+        for symbol in reversed(self.symbol_output):
+            if " " in symbol:
+                break
+            token.append(symbol)
+        return "".join(reversed(token)).lower()
+
+    def update_predictions(self):
+        """
+        Updates the word predictions, completions of the word being typed or, between words, likely next words
+        """
+        token = self.get_last_token()
+        if token:
+            self.word_predictions = self.word_predictor.predict_token(token)
+        else:
+            self.word_predictions = self.next_word_model.predict(tokenize(self.get_output_symbols())[-2:])
+
     def get_symbol_set(self, length):
         """
         Returns a list of specified length containing symbols from the current set, starting at the current symbol
@@ -79,48 +117,51 @@ class SymbolManager:
             self.current_set = 5
             self.current_symbol = 0
         elif symbol == "ENTER":
-            self.tts.say(self.get_output_symbols())
-            self.tts.runAndWait()
+            self.speech.say(self.get_output_symbols())
+            self.next_word_model.learn(self.get_output_symbols())
             self.symbol_output = []
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "ERASE":
             if len(self.symbol_output) > 0:
                 self.symbol_output.pop()
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "SPACE":
             self.symbol_output.append(" ")
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "ACCEPT1":
-            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1:
+            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1 and \
+                    self.symbol_output[len(self.symbol_output)-1] != " ":
                 self.symbol_output.pop()
             self.symbol_output.append(self.word_predictions[0] + " ")
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "ACCEPT2":
-            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1:
+            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1 and \
+                    self.symbol_output[len(self.symbol_output)-1] != " ":
                 self.symbol_output.pop()
             self.symbol_output.append(self.word_predictions[1] + " ")
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "ACCEPT3":
-            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1:
+            while len(self.symbol_output) > 0 and len(self.symbol_output[len(self.symbol_output)-1]) == 1 and \
+                    self.symbol_output[len(self.symbol_output)-1] != " ":
                 self.symbol_output.pop()
             self.symbol_output.append(self.word_predictions[2] + " ")
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
         elif symbol == "":
             pass
         else:
             self.symbol_output.append(symbol)
             self.current_set = 0
             self.current_symbol = 0
-            self.word_predictions = self.word_predictor.predict(self.get_output_symbols())
+            self.update_predictions()
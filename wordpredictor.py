@@ -1,35 +1,118 @@
+import collections
 from fast_autocomplete import autocomplete_factory
 import numpy as np
 import json
 
+WORDS_PATH = 'resources/words.json'     # Dictionary of words and their counts used for fuzzy search
+WORD_LIST_PATH = "resources/datasets/words10k.txt"  # Word list ordered by decreasing frequency
+
+
+def load_word_counts(path=WORD_LIST_PATH):
+    """
+    Reads the word list into a dictionary of words and counts. Every second word is kept and counts decrease with the
+    position in the list, which is how the fuzzy search dictionary is built.
+    :param path:<str> Path of the word list
+    """
+    with open(path, "r") as file:
+        words = [line.rstrip().lower() for line in file]
+    return {words[i]: 10000 - int(i/2) for i in range(0, len(words), 2)}
+
+
+class PrefixIndex:
+    """
+    The PrefixIndex class maps every prefix of every word to its three best completions, precomputed when the index is
+    built, so an exact prefix query costs one hash of the prefix. Completions are ranked the way fast_autocomplete
+    ranks them, an exact match first and then by decreasing count.
+    """
+
+    def __init__(self, counts, size=3):
+        self.size = size    # Number of completions stored per prefix
+        ranked = {}     # Prefix to its size + 1 words with the highest counts
+        for word in sorted(counts, key=lambda word: -counts[word]):
+            for end in range(1, len(word) + 1):
+                words = ranked.setdefault(word[:end], [])
+                if len(words) <= size:
+                    words.append(word)
+        self._completions = {}  # Prefix to a tuple of its best completions
+        for prefix, words in ranked.items():
+            if prefix in counts:
+                words = [prefix] + [word for word in words if word != prefix]
+            self._completions[prefix] = tuple(words[:size])
+
+    def __len__(self):
+        return len(self._completions)
+
+    def lookup(self, prefix):
+        """
+        Returns a tuple of up to size words starting with prefix, best first
+        :param prefix:<str> The lowercase prefix
+        """
+        return self._completions.get(prefix, ())
+
 
 class WordPredictor:
+    """
+    The WordPredictor class suggests three completions for the word being typed. Exact prefix completions come from a
+    prefix index built from the word list, and a fuzzy search only fills the suggestions when fewer than three words
+    start with the prefix. Suggestions for recently seen prefixes are kept in a bounded LRU cache, so erasing a letter
+    or retyping a prefix that needed the fuzzy search costs a single lookup.
+    """
+    CACHE_SIZE = 256    # Number of prefixes whose suggestions are cached
+    SUGGESTIONS = 3     # Number of suggested words
 
     def __init__(self):
         self.autoComplete = autocomplete_factory(
-            content_files={'words': {'filepath': 'resources/words.json', 'compress': True}})
+            content_files={'words': {'filepath': WORDS_PATH, 'compress': True}})
+        self.prefix_index = PrefixIndex(load_word_counts(), WordPredictor.SUGGESTIONS)
+        self._cache = collections.OrderedDict()  # Prefix to its suggestions, least recently used first
 
     @staticmethod
     def make_json():
-        with open("resources/datasets/words10k.txt", "r") as file:
-            words = file.readlines()
-            for i in range(len(words)):
-                words[i] = words[i].rstrip().lower()
-        words = {words[i]: [{}, words[i], 10000 - int(i/2)] for i in range(0, len(words), 2)}
-        with open('resources/words.json', 'w') as outfile:
+        words = load_word_counts()
+        words = {word: [{}, word, count] for word, count in words.items()}
+        with open(WORDS_PATH, 'w') as outfile:
             json.dump(words, outfile)
 
+    @staticmethod
+    def last_token(text):
+        """
+        Returns the lowercase word being typed at the end of text, or an empty string if text ends with a space
+        :param text:<str> The typed text
+        """
+        if text == "" or text[-1] == " ":
+            return ""
+        return text[text.rfind(" ") + 1:].lower()
+
     def predict(self, text):
-        text = text.lower()
-        if text == "" or text == " " or text[-1] == " ":
-            return np.array(["", "", ""])
-        else:
-            text = text.split()
-            text = text[len(text)-1]
-            pred = self.autoComplete.search(word=text, max_cost=3, size=3)
-            while len(pred) < 3:
-                pred.append([""])
-            return np.array(pred).flatten()
+        """
+        Returns three suggestions for the word being typed at the end of text
+        :param text:<str> The typed text
+        """
+        return self.predict_token(self.last_token(text))
+
+    def predict_token(self, token):
+        """
+        Returns three suggestions for a partly typed word, empty strings when there is no word
+        :param token:<str> The lowercase partly typed word
+        """
+        if token == "":
+            return np.array([""] * WordPredictor.SUGGESTIONS)
+        suggestions = self._cache.get(token)
+        if suggestions is not None:
+            self._cache.move_to_end(token)
+            return suggestions
+        suggestions = list(self.prefix_index.lookup(token))
+        if len(suggestions) < WordPredictor.SUGGESTIONS:
+            for result in self.autoComplete.search(word=token, max_cost=3, size=WordPredictor.SUGGESTIONS):
+                if result[0] not in suggestions and len(suggestions) < WordPredictor.SUGGESTIONS:
+                    suggestions.append(result[0])
+            suggestions += [""] * (WordPredictor.SUGGESTIONS - len(suggestions))
+        suggestions = np.array(suggestions)
+        suggestions.flags.writeable = False     # Shared by every caller that hits the cache
+        self._cache[token] = suggestions
+        if len(self._cache) > WordPredictor.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return suggestions
 
 
 #wordPredictor = WordPredictor()
@@ -41,4 +124,4 @@ class WordPredictor:
 #print(wordPredictor.predict("b"))
 #print(wordPredictor.predict("lolrandomstring"))
 #print(wordPredictor.predict("hi how "))
-#print(wordPredictor.predict("hel"))
\ No newline at end of file
+#print(wordPredictor.predict("hel"))